@@ -0,0 +1,247 @@
+"""
+benchmark
+
+benchmarks for the preprocess tiling toolkit.
+
+    python -m preprocess.benchmark profiles    # bytes per tile and encode time per output profile
+    python -m preprocess.benchmark tiling      # tile_image throughput on synthetic scenes, local or s3 (moto)
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import resource
+import socket
+import subprocess
+
+from concurrent import futures
+from itertools import product
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep
+
+import numpy as np
+import rasterio as rio
+from mercantile import Tile
+from rasterio.transform import from_origin
+from rasterio.warp import transform as transform_points
+from rasterio.windows import Window
+
+from preprocess.tile import _encode_tile
+
+# (name, _encode_tile options) pairs compared by `profiles`
+PROFILES = [
+    ('native', {}),
+    ('float32', {'dtype' : 'float32'}),
+    ('float32 deflate', {'dtype' : 'float32', 'compress' : 'deflate', 'blocksize' : 256}),
+    ('float32 zstd', {'dtype' : 'float32', 'compress' : 'zstd', 'blocksize' : 256}),
+    ('scaled deflate', {'dtype' : 'scaled', 'compress' : 'deflate', 'blocksize' : 256}),
+    ('scaled lzw', {'dtype' : 'scaled', 'compress' : 'lzw', 'blocksize' : 256}),
+    ('scaled zstd', {'dtype' : 'scaled', 'compress' : 'zstd', 'blocksize' : 256}),
+]
+
+def synthetic_tile(bands = 4, size = 512, seed = 0):
+    """
+    uint16 tile resembling Planet surface reflectance DNs: smooth spatial structure plus sensor noise, so compression ratios are realistic (pure noise does not compress).
+    """
+    rng = np.random.RandomState(seed)
+    rows, cols = np.mgrid[0:size, 0:size] / size
+    tile = np.empty((bands, size, size), dtype = np.uint16)
+    for b in range(bands):
+        phase = rng.uniform(0, 2 * np.pi, 2)
+        field = np.sin(4 * rows + phase[0]) * np.cos(3 * cols + phase[1])
+        tile[b] = np.clip(4000 + 2500 * field + rng.normal(0, 40, (size, size)), 1, 10000)
+
+    return tile
+
+def benchmark_profiles(n_tiles = 20, bands = 4, quant = 10000, profiles = PROFILES):
+    """
+    encodes <n_tiles> synthetic tiles with each output profile. returns [(name, bytes per tile, ms per tile)].
+    """
+    tiles = [synthetic_tile(bands, seed = i) for i in range(n_tiles)]
+    mask = np.full(tiles[0].shape[1:], 255, dtype = np.uint8)
+
+    results = []
+    for name, options in profiles:
+        nbytes = 0
+        start = perf_counter()
+        for i, data in enumerate(tiles):
+            nbytes += len(_encode_tile(Tile(i, 0, 15), data, mask,
+                                       quant = quant, skip_blanks = False,
+                                       nodata_val = None, **options))
+        elapsed = perf_counter() - start
+        results.append((name, nbytes / n_tiles, 1000 * elapsed / n_tiles))
+
+    return results
+
+def synthetic_scene(filename, width = 4096, height = 4096, bands = 4, crs = 'EPSG:32611', res = 3.0, seed = 0, center = (-119.5, 37.8), nodata = 0):
+    """
+    writes a uint16 GeoTIFF scene of <width> x <height> pixels of <res> (crs units) centred on <center> (lon, lat), with the same structure as synthetic_tile. a triangle of 0s across one corner mimics the ragged edge of a Planet scene; it is nodata unless <nodata> is None (no nodata value). written in row blocks, so scenes larger than memory are fine.
+    """
+    xs, ys = transform_points('EPSG:4326', crs, [center[0]], [center[1]])
+    profile = {
+        'driver' : 'GTiff',
+        'width' : width,
+        'height' : height,
+        'count' : bands,
+        'dtype' : 'uint16',
+        'crs' : crs,
+        'transform' : from_origin(xs[0] - width * res / 2, ys[0] + height * res / 2, res, res),
+        'nodata' : nodata,
+        'tiled' : True,
+        'blockxsize' : 256,
+        'blockysize' : 256,
+        'compress' : 'deflate'
+    }
+
+    rng = np.random.RandomState(seed)
+    phases = rng.uniform(0, 2 * np.pi, (bands, 2))
+    with rio.open(filename, 'w', **profile) as dst:
+        for row in range(0, height, 256):
+            n_rows = min(256, height - row)
+            rows, cols = np.mgrid[row:row + n_rows, 0:width] / 512
+            block = np.empty((bands, n_rows, width), dtype = np.uint16)
+            for b in range(bands):
+                field = np.sin(4 * rows + phases[b, 0]) * np.cos(3 * cols + phases[b, 1])
+                block[b] = np.clip(4000 + 2500 * field + rng.normal(0, 40, (n_rows, width)), 1, 10000)
+            block[:, (rows + cols) * 512 < 0.2 * min(width, height)] = 0
+            dst.write(block, window = Window(0, row, width, n_rows))
+
+    return filename
+
+def _run_tiling(image, output_dir, zoom, options):
+    """
+    tile <image> in this process (run each configuration in a fresh one, so peak RSS is its own). returns (tiles, written, seconds, bytes written, peak RSS in MB).
+    """
+    from preprocess.tile import tile_image
+
+    start = perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = tile_image(image, output_dir, zoom, **options)
+    elapsed = perf_counter() - start
+
+    written = sum(ok for _, ok in result.tiles)
+    nbytes = result.timings.get('bytes', {}).get('total', 0)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kB on linux
+
+    return len(result.tiles), written, elapsed, nbytes, peak_rss
+
+def benchmark_tiling(scenes, output_dir, configs, zoom = 15, quant = 10000, s3_endpoint_url = None):
+    """
+    runs tile_image on each of <scenes> ({name: image path}) once per configuration in <configs>, a list of (name, tile_image options), each in its own process. tiles go to <output_dir>/<run>/, which can be s3:// (against <s3_endpoint_url>, e.g. a moto server).
+
+    returns [(scene, config, tiles, tiles/s, MB/s, peak RSS MB)].
+    """
+    results = []
+    for run, ((scene, image), (name, options)) in enumerate(product(sorted(scenes.items()), configs)):
+        options = dict(options, quant = quant, s3_endpoint_url = s3_endpoint_url)
+        with futures.ProcessPoolExecutor(max_workers = 1) as executor:
+            n_tiles, written, elapsed, nbytes, peak_rss = executor.submit(
+                _run_tiling, image, "{}/run{}".format(output_dir, run), zoom, options).result()
+
+        results.append((scene, name, n_tiles, n_tiles / elapsed, nbytes / 1024 / 1024 / elapsed, peak_rss))
+
+    return results
+
+def _start_moto(port = 5000):
+    "start a local moto S3 server; returns (process, endpoint url)"
+    server = subprocess.Popen(["moto_server", "s3", "-p", str(port)],
+                              stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout = 1).close()
+            break
+        except OSError:
+            sleep(0.1)
+    else:
+        server.terminate()
+        raise RuntimeError("moto_server did not start on port {}".format(port))
+
+    return server, "http://127.0.0.1:{}".format(port)
+
+def _create_bucket(bucket, endpoint_url):
+    import boto3
+
+    client = boto3.client('s3', endpoint_url = endpoint_url, region_name = 'us-east-1')
+    try:
+        client.create_bucket(Bucket = bucket)
+    except client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+def _tiling(args):
+    profiles = dict(PROFILES)
+    configs = [("{} r{}/u{}".format(profile, read_workers, upload_workers),
+                dict(profiles[profile], read_workers = read_workers, upload_workers = upload_workers))
+               for profile, read_workers, upload_workers in product(args.profiles, args.read_workers, args.upload_workers)]
+
+    server = None
+    endpoint_url = args.s3_endpoint_url
+    if args.moto:
+        # moto accepts any credentials, but boto3 needs some
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+        server, endpoint_url = _start_moto(args.moto_port)
+
+    try:
+        with TemporaryDirectory() as tmp:
+            scenes = {}
+            for crs in args.crs:
+                name = "{}x{} {}".format(args.size[0], args.size[1], crs)
+                print("writing synthetic scene {}".format(name))
+                scenes[name] = synthetic_scene(path.join(tmp, "scene_{}.tif".format(crs.replace(':', '_'))),
+                                               args.size[0], args.size[1], args.bands, crs, args.res)
+
+            output_dir = path.join(tmp, "tiles")
+            if endpoint_url is not None:
+                _create_bucket(args.bucket, endpoint_url)
+                output_dir = "s3://{}/tiles".format(args.bucket)
+
+            print("{:<28} {:<26} {:>7} {:>9} {:>8} {:>14}".format("scene", "config", "tiles", "tiles/s", "MB/s", "peak RSS (MB)"))
+            for scene, name, n_tiles, tiles_per_s, mb_per_s, peak_rss in benchmark_tiling(
+                    scenes, output_dir, configs, args.zoom, args.quant, endpoint_url):
+                print("{:<28} {:<26} {:>7} {:>9.1f} {:>8.1f} {:>14.0f}".format(scene, name, n_tiles, tiles_per_s, mb_per_s, peak_rss))
+    finally:
+        if server is not None:
+            server.terminate()
+
+def _profiles(args):
+    print("{:<20} {:>14} {:>12}".format("profile", "bytes/tile", "ms/tile"))
+    for name, bytes_per_tile, ms in benchmark_profiles(args.n_tiles, args.bands, args.quant):
+        print("{:<20} {:>14,.0f} {:>12.1f}".format(name, bytes_per_tile, ms))
+
+def add_parsers():
+    parser = argparse.ArgumentParser(prog = "preprocess.benchmark")
+    subparser = parser.add_subparsers(title = "benchmarks", metavar = "")
+
+    profiles = subparser.add_parser("profiles", help = "bytes per tile and encode time for each output profile",
+                                    formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+    profiles.add_argument("--n_tiles", help = "tiles encoded per profile", type = int, default = 20)
+    profiles.add_argument("--bands", help = "bands per tile", type = int, default = 4)
+    profiles.add_argument("--quant", help = "quantization value tiles are divided by", type = int, default = 10000)
+    profiles.set_defaults(func = _profiles)
+
+    tiling = subparser.add_parser("tiling", help = "tile_image throughput (tiles/s, MB/s, peak RSS) on synthetic scenes, one process per configuration",
+                                  formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+    tiling.add_argument("--size", help = "scene width and height in pixels", nargs = 2, type = int, default = [4096, 4096])
+    tiling.add_argument("--bands", help = "bands per scene", type = int, default = 4)
+    tiling.add_argument("--res", help = "pixel size in scene crs units", type = float, default = 3.0)
+    tiling.add_argument("--crs", help = "scene crs; EPSG:3857 needs no reprojection, anything else is warped per strip", nargs = "+", default = ['EPSG:3857', 'EPSG:32611'])
+    tiling.add_argument("--zoom", help = "tile zoom level", type = int, default = 15)
+    tiling.add_argument("--quant", help = "quantization value tiles are divided by", type = int, default = 10000)
+    tiling.add_argument("--profiles", help = "output profiles to run (see profiles)", nargs = "+", choices = [name for name, _ in PROFILES], default = ['native', 'scaled deflate'])
+    tiling.add_argument("--read_workers", help = "read thread counts to run", nargs = "+", type = int, default = [4])
+    tiling.add_argument("--upload_workers", help = "upload thread counts to run", nargs = "+", type = int, default = [16])
+    tiling.add_argument("--moto", help = "write to a moto S3 server started for the run (needs moto[server])", action = 'store_true')
+    tiling.add_argument("--moto_port", help = "port for --moto", type = int, default = 5000)
+    tiling.add_argument("--s3_endpoint_url", help = "write to this already running S3 stand-in instead of a local directory", default = None)
+    tiling.add_argument("--bucket", help = "bucket tiles are written to with --moto or --s3_endpoint_url", default = "benchmark")
+    tiling.set_defaults(func = _tiling)
+
+    subparser.required = True
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = add_parsers()
+    args.func(args)
@@ -0,0 +1,115 @@
+"""
+dataset_pool
+
+per-thread rasterio dataset handles on one source, so worker threads read in parallel instead of sharing a single (non thread-safe) GDAL handle.
+"""
+
+import threading
+import unittest
+
+from tempfile import TemporaryDirectory
+from os import path
+
+import numpy as np
+import rasterio as rio
+from rasterio.env import get_gdal_config
+
+class TestDatasetPool(unittest.TestCase):
+    def test_dataset_per_thread(self):
+        with TemporaryDirectory() as tmp:
+            filename = path.join(tmp, "scene.tif")
+            with rio.open(filename, 'w', driver = 'GTiff', width = 8, height = 8, count = 1, dtype = 'uint8') as dst:
+                dst.write(np.arange(64, dtype = np.uint8).reshape(1, 8, 8))
+
+            pool = DatasetPool(filename, {'GDAL_CACHEMAX' : 64})
+            src = pool.dataset()
+            self.assertIs(src, pool.dataset())
+
+            other = []
+            t = threading.Thread(target = lambda: other.append(pool.dataset()))
+            t.start()
+            t.join()
+
+            self.assertIsNot(src, other[0])
+            self.assertEqual(len(pool), 2)
+            self.assertTrue((src.read() == other[0].read()).all())
+
+            pool.close()
+            self.assertTrue(src.closed and other[0].closed)
+
+    def test_gdal_cachemax(self):
+        with TemporaryDirectory() as tmp:
+            filename = path.join(tmp, "scene.tif")
+            with rio.open(filename, 'w', driver = 'GTiff', width = 8, height = 8, count = 1, dtype = 'uint8') as dst:
+                dst.write(np.zeros((1, 8, 8), dtype = np.uint8))
+
+            options = gdal_options(gdal_cachemax = 48)
+            pool = DatasetPool(filename, options)
+
+            # what a worker thread sees once its dataset is open, with the run wrapped as in tile_image
+            seen = []
+            def read():
+                pool.dataset().read()
+                seen.append(get_gdal_config('GDAL_CACHEMAX'))
+
+            with rio.Env(**options):
+                t = threading.Thread(target = read)
+                t.start()
+                t.join()
+
+            pool.close()
+            self.assertEqual(seen, [48])
+
+def gdal_options(gdal_cachemax = None, vsi_cache_size = None):
+    """
+    GDAL config options for reading tiles: <gdal_cachemax> (MB) sizes GDAL's raster block cache, which is shared by every handle in the process, so the options must be in effect (rio.Env) for the whole run, not just when opening; <vsi_cache_size> (MB) turns on the per-handle read-ahead cache for remote (/vsis3/, /vsicurl/) sources.
+    """
+    options = {}
+    if gdal_cachemax is not None:
+        options['GDAL_CACHEMAX'] = gdal_cachemax
+    if vsi_cache_size:
+        options.update(VSI_CACHE = True, VSI_CACHE_SIZE = int(vsi_cache_size * 1024 * 1024))
+
+    return options
+
+class DatasetPool(object):
+    """
+    Pool of rasterio datasets on <source>, one per worker thread, opened lazily on first use inside a rio.Env(**<env_options>) and kept for the life of the pool.
+
+    <source> is a path (local or s3://) or a callable returning a newly opened dataset, e.g. a MemoryFile's open or a function building a VRT, for sources that are not plain paths.
+    """
+    def __init__(self, source, env_options = None):
+        self.source = source
+        self.env_options = env_options or {}
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._datasets = []
+
+    def __len__(self):
+        return len(self._datasets)
+
+    def _open(self):
+        with rio.Env(**self.env_options):
+            if callable(self.source):
+                return self.source()
+            return rio.open(self.source)
+
+    def dataset(self):
+        "return the calling thread's dataset, opening it on first use"
+        src = getattr(self._local, 'src', None)
+        if src is None:
+            src = self._open()
+            self._local.src = src
+            with self._lock:
+                self._datasets.append(src)
+
+        return src
+
+    def close(self):
+        "close every thread's dataset"
+        with self._lock:
+            for src in self._datasets:
+                src.close()
+            self._datasets = []
+        self._local = threading.local()
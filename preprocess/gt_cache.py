@@ -0,0 +1,178 @@
+"""
+gt_cache
+
+content-addressed cache of gt_pre outputs (binary raster, footprint), keyed on the input's content hash (or S3 ETag) and the processing parameters, so reruns on unchanged inputs skip the pixel work.
+"""
+
+import json
+import shutil
+import unittest
+
+from hashlib import sha256
+from os import path, makedirs, listdir, link, remove, rename, utime, getpid, walk, stat
+from tempfile import TemporaryDirectory
+from time import sleep
+
+class TestGtCache(unittest.TestCase):
+    def test_get_put_evict(self):
+        with TemporaryDirectory() as tmp:
+            gt_file, out_dir = path.join(tmp, "flight.tif"), path.join(tmp, "out")
+            makedirs(out_dir)
+            with open(gt_file, 'wb') as f:
+                f.write(b"depths")
+
+            cache = GtCache(path.join(tmp, "cache"), max_size = 1.5 / 1024) # MB: room for one entry
+            key = cache.key(gt_file, threshold = 0.1)
+            self.assertNotEqual(key, cache.key(gt_file, threshold = 0.2))
+            self.assertEqual(content_key(gt_file), content_key(gt_file))
+            self.assertEqual(file_stamp(gt_file)[1], len(b"depths"))
+            self.assertIsNone(cache.get(key, out_dir, gt_file))
+
+            binary = path.join(out_dir, "flight_binary.tif")
+            with open(binary, 'wb') as f:
+                f.write(b"0" * 1024)
+            cache.put(key, {'binary' : binary, 'footprint' : None}, gt_file)
+
+            remove(binary)
+            hit = cache.get(key, out_dir, gt_file)
+            self.assertEqual(hit['binary'], binary)
+            self.assertTrue(path.exists(binary))
+
+            # a second entry pushes the size over the limit: the least recently used goes
+            sleep(0.01)
+            other = cache.key(gt_file, threshold = 0.2)
+            cache.put(other, {'binary' : binary, 'footprint' : None}, gt_file)
+            self.assertIsNone(cache.get(key, out_dir, gt_file))
+            self.assertIsNotNone(cache.get(other, out_dir, gt_file))
+
+def file_stamp(filename):
+    """
+    cheap identity of a file, without reading it: "etag:<ETag>" for s3://, (path, size, mtime) for local files. None if unknown (e.g. http urls).
+    """
+    if filename.startswith("s3://"):
+        import boto3
+        bucket, key = filename[5:].split("/", 1)
+        return "etag:" + boto3.client('s3').head_object(Bucket = bucket, Key = key)['ETag'].strip('"')
+
+    if not path.exists(filename):
+        return None
+
+    st = stat(filename)
+    return (path.abspath(filename), st.st_size, st.st_mtime_ns)
+
+_digests = {}
+
+def content_key(filename, chunk_size = 2 ** 23):
+    """
+    identity of a file's contents: the object's ETag for s3://, sha256 of the bytes for local files (streamed, no pixels decoded; remembered per file_stamp). None if unknown.
+    """
+    stamp = file_stamp(filename)
+    if stamp is None or not isinstance(stamp, tuple):
+        return stamp
+
+    if stamp not in _digests:
+        digest = sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        _digests[stamp] = "sha256:" + digest.hexdigest()
+
+    return _digests[stamp]
+
+def _dir_size(dirname):
+    return sum(path.getsize(path.join(root, name)) for root, _, names in walk(dirname) for name in names)
+
+def _link_or_copy(src, dst):
+    if path.exists(dst):
+        remove(dst)
+    try:
+        link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+class GtCache(object):
+    """
+    gt_pre outputs stored under <cache_dir>/<key>/, one entry per input content and parameter set (see key). get() links (or copies) a cached entry's files into an output directory; put() stores a new entry and, if <max_size> (MB) is set, evicts least recently used entries until the cache fits.
+
+    entries are written to a temporary directory and renamed into place, so concurrent gt_pre processes sharing a cache never see half-written entries.
+    """
+    def __init__(self, cache_dir, max_size = None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        makedirs(cache_dir, exist_ok = True)
+
+    def key(self, gt_file, **params):
+        "cache key for <gt_file> processed with <params>, or None if the file's content cannot be identified"
+        content = content_key(gt_file)
+        if content is None:
+            return None
+
+        return sha256(json.dumps([content, params], sort_keys = True).encode()).hexdigest()
+
+    def get(self, key, output_dir, gt_file):
+        """
+        place a cached entry's outputs in output_dir. returns {'gt_file', 'binary', 'footprint'} paths like gt_pre, or None on a miss
+        """
+        entry = path.join(self.cache_dir, key)
+        meta_file = path.join(entry, "meta.json")
+        try:
+            with open(meta_file) as f:
+                meta = json.load(f)
+
+            outputs = {'gt_file' : gt_file, 'binary' : gt_file, 'footprint' : None}
+            for name in ['binary', 'footprint']:
+                if meta[name] is not None:
+                    outputs[name] = path.join(output_dir, meta[name])
+                    _link_or_copy(path.join(entry, meta[name]), outputs[name])
+            utime(meta_file) # most recently used
+        except (OSError, ValueError):
+            return None # missing, or evicted meanwhile
+
+        return outputs
+
+    def put(self, key, outputs, gt_file):
+        "store gt_pre <outputs> ({'binary', 'footprint'} paths) computed from gt_file under key"
+        entry = path.join(self.cache_dir, key)
+        if path.exists(entry):
+            return
+
+        tmp = path.join(self.cache_dir, ".tmp-{}-{}".format(key, getpid()))
+        makedirs(tmp, exist_ok = True)
+
+        meta = {'gt_file' : gt_file, 'binary' : None, 'footprint' : None}
+        for name in ['binary', 'footprint']:
+            # an input that was already binary is not copied
+            if outputs.get(name) is not None and outputs[name] != gt_file:
+                meta[name] = path.basename(outputs[name])
+                _link_or_copy(outputs[name], path.join(tmp, meta[name]))
+
+        with open(path.join(tmp, "meta.json"), 'w') as f:
+            json.dump(meta, f)
+
+        try:
+            rename(tmp, entry)
+        except OSError: # another process stored it first
+            shutil.rmtree(tmp, ignore_errors = True)
+
+        self.evict(keep = key)
+
+    def evict(self, keep = None):
+        "remove least recently used entries (other than <keep>) until the cache is within max_size"
+        if self.max_size is None:
+            return
+
+        entries = []
+        for key in listdir(self.cache_dir):
+            meta_file = path.join(self.cache_dir, key, "meta.json")
+            if key.startswith(".") or not path.exists(meta_file):
+                continue
+            entries.append((path.getmtime(meta_file), key, _dir_size(path.join(self.cache_dir, key))))
+
+        total = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total <= self.max_size * 1024 * 1024:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(path.join(self.cache_dir, key), ignore_errors = True)
+            total -= size
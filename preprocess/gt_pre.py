@@ -2,14 +2,22 @@ import argparse
 
 import unittest
 
-from raster_utils import reproject_raster
-
 import rasterio as rio
 from rasterio import warp
 from rasterio.transform import guard_transform
-from numpy import ma
+from rasterio.windows import Window
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import calculate_default_transform, Resampling
+import numpy as np
+
+from raster_utils import valid_footprint
+from preprocess.gt_cache import GtCache, file_stamp
 
-from os import path, remove, makedirs
+from os import path, remove, makedirs, cpu_count
+from concurrent import futures
+from glob import glob
+from tempfile import TemporaryDirectory
+from time import perf_counter
 
 import json
 import geopandas as gpd
@@ -30,6 +38,16 @@ Consumes ground truth data and outputs `{gt_raw}_gt_binary_raster` and `{gt_raw}
 """
 
 class TestGtPre(unittest.TestCase):
+    def _write_raster(self, filename, data, nodata = None, res = 3, **options):
+        "write 2d <data> to filename as a single-band EPSG:32611 GeoTIFF with <res> m pixels (plus creation <options>); returns filename"
+        profile = dict({
+            'driver' : 'GTiff', 'dtype' : data.dtype.name, 'count' : 1, 'height' : data.shape[0], 'width' : data.shape[1],
+            'nodata' : nodata, 'crs' : 'EPSG:32611', 'transform' : rio.transform.from_origin(300000, 4200000, res, res)
+        }, **options)
+        with rio.open(filename, 'w', **profile) as dst:
+            dst.write(data, 1)
+        return filename
+
     def test_filetype(self):
         self.assertEqual(_filetype("test.shp"), 'shp')
         self.assertEqual(_filetype("test.tif"), 'tif')
@@ -51,6 +69,32 @@ class TestGtPre(unittest.TestCase):
 
         remove(tmp_threshed)
 
+    def test_threshold_blocks(self):
+        data = np.linspace(0, 2, 300 * 200, dtype = 'float32').reshape(300, 200)
+        data[:10, :] = -9999
+
+        with TemporaryDirectory() as tmp:
+            src_name = self._write_raster(path.join(tmp, "depth.tif"), data, nodata = -9999)
+            out_name = path.join(tmp, "depth_binary.tif")
+
+            _threshold_raster(src_name, out_name, threshold = 0.5, workers = 2, band_pixels = 200 * 32)
+            threshed = rio.open(out_name).read(1)
+
+            # thresholded and warped in one pass; outside the source is nodata
+            _threshold_raster(src_name, out_name, threshold = 0.5, dst_crs = 4326, workers = 1)
+            with rio.open(out_name) as warped:
+                self.assertEqual(warped.crs.to_epsg(), 4326)
+                warped_data = warped.read(1)
+            self.assertTrue(set(np.unique(warped_data)) <= set([0, 1, -9999]))
+            # the UTM grid is rotated in EPSG:4326, so the output's corners lie outside the source
+            self.assertEqual(warped_data[0, 0], -9999)
+            self.assertEqual(warped_data[-1, -1], -9999)
+            self.assertGreater((warped_data == 1).sum(), 0)
+
+        expected = (data >= 0.5).astype('int16')
+        expected[:10, :] = 1 # nodata fills with bool(nodata), as the masked-array version did
+        self.assertTrue(np.array_equal(threshed, expected))
+
     def test_write_vector(self):
         binaryVector = "./test/aso_thresh_01.tif"
         json_representation = "./test/aso_thresh.geojson"
@@ -63,6 +107,63 @@ class TestGtPre(unittest.TestCase):
 
         self.assertEqual(correct, test)
 
+    def test_batch(self):
+        with TemporaryDirectory() as tmp:
+            for name in ["flight_a.tif", "flight_b.tif"]:
+                self._write_raster(path.join(tmp, name), np.linspace(0, 1, 32 * 32, dtype = 'float32').reshape(32, 32), nodata = -9999)
+
+            out_dir = path.join(tmp, "out")
+            makedirs(out_dir)
+            entries = gt_pre_batch(_expand_gt_files([path.join(tmp, "flight_*.tif"), path.join(tmp, "missing.tif")]),
+                                   out_dir, threshold = 0.5, batch_workers = 2)
+
+            with open(path.join(out_dir, "gt_pre_manifest.jsonl")) as mf:
+                manifest = [json.loads(line) for line in mf]
+
+        self.assertEqual(sorted(e['status'] for e in entries), ['done', 'done', 'failed'])
+        self.assertEqual(len(manifest), 3)
+        self.assertTrue(all('threshold' in e['timings'] for e in manifest if e['status'] == 'done'))
+
+    def test_largest_component(self):
+        data = np.zeros((40, 30), dtype = 'uint8')
+        data[2:4, 2:4] = 1     # 4 pixels
+        data[5:30, 10] = 1     # 25 pixels in a column, spanning band edges...
+        data[29, 10:20] = 1    # ...joined to a row: 34 pixels
+        data[35:39, 20:29] = 1 # 36 pixels, in one band
+        data[30, 20] = 1       # diagonal to the row above: not 4-connected
+
+        with TemporaryDirectory() as tmp:
+            block = self._write_raster(path.join(tmp, "block.tif"), data)
+            data[35:39, 20:29] = 0
+            snake = self._write_raster(path.join(tmp, "snake.tif"), data)
+
+            self.assertEqual(_largest_component(rio.open(block), band_rows = 8),
+                             Window.from_slices((35, 39), (20, 29)))
+            self.assertEqual(_largest_component(rio.open(snake), band_rows = 8),
+                             Window.from_slices((5, 30), (10, 20)))
+
+            # the same region rebuilt band by band: the stray diagonal pixel and the small patch are left out
+            component = np.zeros_like(data, dtype = bool)
+            for window, mask in _component_masks(rio.open(snake), band_rows = 8):
+                component[window.toslices()] = mask
+            self.assertEqual(component.sum(), 34)
+            self.assertTrue(component[5:30, 10].all() and component[29, 10:20].all())
+
+    def test_valid_footprint(self):
+        data = np.full((256, 256), -9999, dtype = 'float32')
+        rows, cols = np.mgrid[0:256, 0:256]
+        data[(rows - 128) ** 2 + (cols - 128) ** 2 < 100 ** 2] = 1.0 # a round flight in a square raster
+
+        with TemporaryDirectory() as tmp:
+            flight = self._write_raster(path.join(tmp, "flight.tif"), data, nodata = -9999, res = 30)
+
+            footprint = _valid_footprint(flight, decimation = 8, max_vertices = 30)
+            bbox = _footprint(flight)
+
+        self.assertLessEqual(_n_vertices(footprint), 30)
+        self.assertLess(footprint.area, 0.9 * bbox.area)
+        self.assertTrue(bbox.buffer(1e-6).contains(footprint))
+
     def test_check_binary(self):
         raw_aso = "https://aso.jpl.nasa.gov/_include/new_geotiff/USCATE20170129_SUPERswe_50p0m_agg.tif"
         aso_threshed = "./test/aso_thresh_01.tif"
@@ -73,6 +174,20 @@ class TestGtPre(unittest.TestCase):
         self.assertTrue(_is_binary_raster(binary))
         self.assertFalse(_is_binary_raster(nonbinary))
 
+    def test_check_binary_blocks(self):
+        data = np.zeros((64, 64), dtype = 'uint8')
+        data[:32, :] = 1
+        blocks = {'tiled' : True, 'blockxsize' : 16, 'blockysize' : 16}
+
+        with TemporaryDirectory() as tmp:
+            binary = self._write_raster(path.join(tmp, "binary.tif"), data, **blocks)
+            data[-1, -1] = 2 # only in the last block, invisible at low resolution
+            nonbinary = self._write_raster(path.join(tmp, "nonbinary.tif"), data, **blocks)
+
+            self.assertTrue(_is_binary_raster(binary))
+            self.assertFalse(_is_binary_raster(nonbinary))
+            self.assertIn((binary, file_stamp(binary)), _binary_cache)
+
 
 
 def add_parser(subparser):
@@ -82,8 +197,8 @@ def add_parser(subparser):
         formatter_class = argparse.ArgumentDefaultsHelpFormatter
     )
 
-    parser.add_argument("--gt_file", help="ground truth filename.",
-                        required=True)
+    parser.add_argument("--gt_file", help="ground truth filename, or several filenames / glob patterns (local or s3://) processed as a batch.",
+                        required=True, nargs="+")
     parser.add_argument("--threshold", help="threshold for ", type=float)
 
     parser.add_argument("--dst_crs", help="EPSG code to reproject binary output raster into. Otherwise will keep source CRS.", type=int)
@@ -92,6 +207,22 @@ def add_parser(subparser):
 
     parser.add_argument("--footprint", action="store_true", help="output vector footprint as GeoJSON")
 
+    parser.add_argument("--footprint_mode", help="bbox: footprint is the raster's bounding box; valid: outline of its valid (non-nodata) pixels, traced from a decimated read of the nodata mask", choices=['bbox', 'valid'], default='bbox')
+
+    parser.add_argument("--footprint_vertices", help="with --footprint_mode valid, maximum vertices in the simplified footprint", type=int, default=200)
+
+    parser.add_argument("--cache_dir", help="reuse outputs of earlier runs on the same input content (sha256, or S3 ETag) and parameters, kept in this directory", default=None)
+
+    parser.add_argument("--cache_size", help="with --cache_dir, maximum cache size (MB); least recently used entries are evicted", type=float, default=None)
+
+    parser.add_argument("--workers", help="processes thresholding the raster block by block (Default: one per cpu; 1 in batch mode)", type=int, default=None)
+
+    parser.add_argument("--batch_workers", help="with several ground truth files, number of files processed concurrently, one process each (Default: one per cpu)", type=int, default=None)
+
+    parser.add_argument("--max_memory", help="with several ground truth files, address space limit per batch process (MB); a file exceeding it fails on its own", type=float, default=None)
+
+    parser.add_argument("--manifest", help="with several ground truth files, JSON lines file recording each file's outputs, status and timings (Default: <output_dir>/gt_pre_manifest.jsonl)", default=None)
+
 
     parser.set_defaults(func = main)
 
@@ -126,50 +257,260 @@ def _footprint(file):
     return(generate_polygon(bds_trans))
 
 
+def _n_vertices(geom):
+    "number of ring vertices in a Polygon or MultiPolygon"
+    polygons = getattr(geom, 'geoms', [geom])
+    return sum(len(p.exterior.coords) + sum(len(r.coords) for r in p.interiors) for p in polygons)
+
+def _valid_footprint(file, decimation = 16, max_vertices = 200):
+    """
+    polygon (EPSG:4326) around file's valid, non-nodata pixels instead of its whole bounding box: traced from the nodata mask read at 1/<decimation> resolution (see raster_utils.valid_footprint), then simplified by at most that pixel to have at most <max_vertices> vertices, or replaced by its convex hull (or minimum rotated rectangle) if that is not enough.
+    """
+    from shapely.geometry import shape, mapping
+
+    with rio.open(file) as ds:
+        footprint = valid_footprint(ds, decimation)
+        crs = ds.crs
+        tolerance = max(abs(ds.res[0]), abs(ds.res[1])) * decimation
+
+    # valid_footprint buffers by a decimated pixel, so simplifying within that (and no further) keeps the valid pixels covered
+    simplified = footprint
+    if _n_vertices(simplified) > max_vertices:
+        simplified = footprint.simplify(tolerance, preserve_topology = True)
+
+    # still over budget: shapes that contain the footprint, the convex hull or else the minimum rotated rectangle
+    if _n_vertices(simplified) > max_vertices:
+        simplified = footprint.convex_hull
+    if _n_vertices(simplified) > max_vertices:
+        simplified = simplified.minimum_rotated_rectangle
+
+    return shape(warp.transform_geom(crs, 'EPSG:4326', mapping(simplified)))
+
 def _filetype(filename):
     "return extension of file without '.' "
     return(path.splitext(filename)[1])[1:]
 
-def _threshold_raster(file, out_name, threshold=0.9, dst_crs = None):
+def _threshold_block(data, threshold, nodata):
+    "int16 (data >= threshold); nodata pixels are set to bool(nodata)"
+    threshed = (data >= threshold).astype('int16')
+    if nodata is not None:
+        threshed[data == nodata] = bool(nodata)
+    return threshed
+
+def _threshold_windows(src, band_pixels = 2 ** 22):
     """
-    writes thresholded ground-truth as single-band uint16 tiff
+    windows to threshold src in: its native block windows, or for striped rasters (blocks spanning the full width) and warped VRTs bands of whole rows of about band_pixels pixels, in multiples of 256 rows
     """
-    file = rio.open(file)
-    profile = file.profile
+    block_height, block_width = src.block_shapes[0]
+    if block_width < src.width and not isinstance(src, WarpedVRT):
+        return [window for _, window in src.block_windows(1)]
 
-    # need masked array
-    data = file.read(1)
-    mask = (data == file.nodata)
-    data = ma.array(data, mask = mask, fill_value = file.nodata)
+    rows = max(256, (band_pixels // src.width) // 256 * 256)
+    return [Window(0, row, src.width, min(rows, src.height - row)) for row in range(0, src.height, rows)]
+
+def _warped_source(src, dst_crs):
+    """
+    src as a WarpedVRT on the grid reproject_raster would give it in EPSG:<dst_crs>, nearest resampling. source nodata is warped as an ordinary value (so it thresholds exactly as unwarped); an alpha band marks pixels outside the source.
+    """
+    dst_crs = {'init' : 'EPSG:{}'.format(dst_crs)}
+    transform, width, height = calculate_default_transform(src.crs, dst_crs, src.width, src.height, *src.bounds)
+
+    return WarpedVRT(src, crs = dst_crs, transform = transform, width = width, height = height,
+                     resampling = Resampling.nearest, src_nodata = None, add_alpha = True)
+
+def _read_threshold(src, window, threshold, nodata):
+    "read and threshold one window of src (a dataset, or a _warped_source VRT: pixels outside the source are set to nodata)"
+    threshed = _threshold_block(src.read(1, window = window), threshold, nodata)
+    if isinstance(src, WarpedVRT):
+        # the VRT's dataset_mask ignores the alpha band (it reports all pixels valid): read the alpha itself
+        threshed[src.read(src.count, window = window) == 0] = nodata if nodata is not None else 0
+    return threshed
+
+_worker_sources = {}
+
+def _worker_source(file, dst_crs = None):
+    "this process's own handle on file (warped to dst_crs if given) and its nodata, opened on first use"
+    key = (file, dst_crs)
+    if key not in _worker_sources:
+        src = rio.open(file)
+        _worker_sources[key] = (_warped_source(src, dst_crs) if dst_crs is not None else src, src.nodata)
+    return _worker_sources[key]
+
+def _threshold_window(window, file, threshold, dst_crs = None):
+    "process pool task: read and threshold one window through the worker's handle"
+    src, nodata = _worker_source(file, dst_crs)
+    return window, _read_threshold(src, window, threshold, nodata)
+
+def _threshold_raster(file, out_name, threshold=0.9, dst_crs = None, workers = None, band_pixels = 2 ** 22):
+    """
+    writes thresholded ground-truth as single-band int16 tiff (tiled, deflate). nodata pixels are written as bool(nodata), as in the original masked-array version.
+
+    streams: the source is read and thresholded one window at a time (see _threshold_windows) by a pool of <workers> processes (default: one per cpu; 1 runs in this process), with at most 2 * workers windows in flight, and each window is written as soon as it is done, so memory use does not grow with the raster.
+
+    with dst_crs (an EPSG code), windows are read through a WarpedVRT onto the EPSG:<dst_crs> grid (nearest resampling) and thresholded on the way, so the reprojected output is written in the same single pass; pixels outside the source are nodata.
+    """
+    if workers is None:
+        workers = cpu_count() or 1
+
+    src = source = rio.open(file)
+    nodata = source.nodata
+    profile = source.profile
+
+    block_height, block_width = src.block_shapes[0]
+    tiled = block_width < src.width and block_height % 16 == 0 and block_width % 16 == 0
+
+    if dst_crs is not None:
+        src = _warped_source(src, dst_crs)
+        profile.update(crs = src.crs, width = src.width, height = src.height, transform = src.transform)
+        tiled = False
 
     profile.update(dtype='int16')
     profile.update(transform=guard_transform(profile['transform']))
+    profile.update(tiled = True, compress = 'deflate',
+                   blockxsize = block_width if tiled else 256,
+                   blockysize = block_height if tiled else 256)
+
+    windows = _threshold_windows(src, band_pixels)
+
     with rio.open(out_name, 'w', **profile) as dest:
-        threshed = (data >= threshold) # masked array op
-        data = (threshed).filled().astype('int16') # fill mask with nodata.
-        dest.write(data, 1)
+        if workers == 1:
+            for window in windows:
+                dest.write(_read_threshold(src, window, threshold, nodata), 1, window = window)
+        else:
+            # at most 2 windows per worker in flight, written in completion order: map() would
+            # submit every window at once and hold finished ones until those before them are done
+            with futures.ProcessPoolExecutor(max_workers = workers) as executor:
+                in_flight = set()
+                for window in windows:
+                    if len(in_flight) >= 2 * workers:
+                        done, in_flight = futures.wait(in_flight, return_when = futures.FIRST_COMPLETED)
+                        for job in done:
+                            done_window, threshed = job.result()
+                            dest.write(threshed, 1, window = done_window)
+                    in_flight.add(executor.submit(_threshold_window, window, file, threshold, dst_crs))
+
+                for job in futures.as_completed(in_flight):
+                    done_window, threshed = job.result()
+                    dest.write(threshed, 1, window = done_window)
+
+    if src is not source:
+        src.close()
+    source.close()
+
+
+
+def _components(src, band_rows = 1024):
+    """
+    labels the 4-connected regions of value 1 in band 1 of src <band_rows> rows at a time (scipy.ndimage.label), joining labels that touch across band edges with a union-find, so only one band of labels is held at once.
 
-    if dst_crs is not None:
-        reproject_raster(out_name, dst_crs, out_name)
+    band labels are numbered on from the previous band's (band i's labels start after offsets[i]); returns (roots, sizes, boxes, offsets) where roots[label - 1] is the joined component of each label and sizes, boxes its pixel count and (row start, row stop, col start, col stop).
+    """
+    from scipy import ndimage
+
+    parent = [0] # union-find over global labels; 0 is background
+    sizes, boxes, offsets = [], [], []
+
+    def __find(label):
+        while parent[label] != label:
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    n_labels = 0
+    previous = None # global labels of the last row of the previous band
+    for row in range(0, src.height, band_rows):
+        window = Window(0, row, src.width, min(band_rows, src.height - row))
+        labels, n = ndimage.label(src.read(1, window = window) == 1)
+
+        offsets.append(n_labels)
+        sizes.extend(np.bincount(labels.ravel(), minlength = n + 1)[1:].tolist())
+        boxes.extend((rows.start + row, rows.stop + row, cols.start, cols.stop)
+                     for rows, cols in ndimage.find_objects(labels))
+        parent.extend(range(n_labels + 1, n_labels + n + 1))
+
+        first = np.where(labels[0] > 0, labels[0] + n_labels, 0)
+        if previous is not None:
+            touching = (previous > 0) & (first > 0)
+            for a, b in set(zip(previous[touching].tolist(), first[touching].tolist())):
+                root_a, root_b = __find(a), __find(b)
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+
+        previous = np.where(labels[-1] > 0, labels[-1] + n_labels, 0)
+        n_labels += n
+
+    roots = np.array([__find(label) for label in range(1, n_labels + 1)], dtype = int)
+    return roots, sizes, np.array(boxes, dtype = int).reshape(-1, 4), offsets
+
+def _largest_root(roots, sizes, boxes):
+    "root label of the largest joined component and its bounding box as a Window"
+    largest = np.argmax(np.bincount(roots, weights = sizes))
+
+    boxes = boxes[roots == largest]
+    return largest, Window.from_slices((boxes[:, 0].min(), boxes[:, 1].max()), (boxes[:, 2].min(), boxes[:, 3].max()))
+
+def _largest_component(src, band_rows = 1024):
+    "window around the largest 4-connected region of value 1 in band 1 of src, or None if there are no 1s (see _components)"
+    roots, sizes, boxes, _ = _components(src, band_rows)
+    if len(roots) == 0:
+        return None
+
+    return _largest_root(roots, sizes, boxes)[1]
+
+def _component_masks(src, band_rows = 1024):
+    """
+    the largest 4-connected region of value 1 in band 1 of src as (window, mask) pieces, one per band of <band_rows> rows it spans, clipped to its bounding box.
+
+    each band is labelled again exactly as in _components and its labels mapped to their joined component, so as in labelling no more than one band is held at once.
+    """
+    from scipy import ndimage
 
+    roots, sizes, boxes, offsets = _components(src, band_rows)
+    if len(roots) == 0:
+        return
 
+    largest, bounds = _largest_root(roots, sizes, boxes)
+    (row_start, row_stop), (col_start, col_stop) = bounds.toranges()
+    in_largest = np.concatenate([[False], roots == largest]) # indexed by global label
+
+    for offset, row in zip(offsets, range(0, src.height, band_rows)):
+        height = min(band_rows, src.height - row)
+        if row + height <= row_start or row >= row_stop:
+            continue
+
+        labels, _ = ndimage.label(src.read(1, window = Window(0, row, src.width, height)) == 1)
+        mask = in_largest[np.where(labels > 0, labels + offset, 0)][:, col_start:col_stop]
+        yield Window(col_start, row, col_stop - col_start, height), mask
 
 def _write_vector(binaryRaster, outfilename):
     """
     writes vector in GeoJSON format (CRS: Lat/Lon WGS84) of polygonized input binary raster (polygon where raster == 1).
+
+    only the largest connected region of 1s is kept: it is found on the pixel grid first and polygonized band by band from its own mask (see _component_masks), so the many small patches never become polygons and the region's bounding box is never held in memory at once.
     """
     from rasterio.features import shapes
     from shapely.geometry import shape, mapping
-    from shapely.ops import cascaded_union
+    from shapely.ops import unary_union
+    from shapely.affinity import affine_transform, translate
+    from affine import Affine
     from geopandas import GeoDataFrame
     from json import dumps
 
     file = rio.open(binaryRaster)
-    s = shapes(file.read(), transform = file.transform)
 
-    s = [shape(s_i).buffer(0) for s_i, value in s if value == 1]
+    # polygonize in pixel coordinates and apply the dataset transform afterwards, giving the same coordinates as polygonizing the whole raster
+    pieces = []
+    for window, mask in _component_masks(file):
+        pieces.extend(translate(shape(s_i), window.col_off, window.row_off)
+                      for s_i, value in shapes(mask.astype('uint8'), mask = mask, transform = Affine.identity()) if value == 1)
+    if not pieces:
+        raise ValueError("{} has no pixels with value 1".format(binaryRaster))
+
+    # pieces from neighbouring bands share edges: merge them back into one region
+    t = file.transform
+    region = affine_transform(unary_union(pieces), [t.a, t.b, t.d, t.e, t.c, t.f]).buffer(0)
 
-    largest = [sorted(s, key = lambda x: x.area, reverse=True)[0]]
+    largest = [max(getattr(region, 'geoms', [region]), key = lambda x: x.area)]
 
     gdf = GeoDataFrame(geometry=largest, crs=file.crs)
     gdf['area'] = gdf.geometry.area
@@ -180,48 +521,235 @@ def _write_vector(binaryRaster, outfilename):
 
     gdf.to_file(outfilename, driver="GeoJSON")
 
-def _is_binary_raster(raster):
-    from numpy import unique
+_binary_cache = {}
 
-    file = rio.open(raster)
-    return(set(unique(file.read())) == set([1, 0]))
+def _is_binary_raster(raster, decimation = 16):
+    """
+    does raster (a filename or open dataset) hold exactly the values {0, 1}?
 
+    cheap rejections first: GDAL band statistics (STATISTICS_MINIMUM/MAXIMUM) or, when the file has overviews, a read at 1/<decimation> resolution served from them with values outside [0, 1] cannot be binary. otherwise blocks are scanned in turn, stopping at the first value other than 0 or 1. answers are cached per file (see gt_cache.file_stamp: a stat, no reading).
+    """
+    file = raster if hasattr(raster, 'read') else rio.open(raster)
+    cache_key = (file.name, file_stamp(file.name))
+    if cache_key[1] is not None and cache_key in _binary_cache:
+        return _binary_cache[cache_key]
+
+    def __outside(values):
+        return bool(((values < 0) | (values > 1)).any())
+
+    binary = None
+    stats = file.tags(1)
+    if 'STATISTICS_MINIMUM' in stats and 'STATISTICS_MAXIMUM' in stats:
+        if float(stats['STATISTICS_MINIMUM']) < 0 or float(stats['STATISTICS_MAXIMUM']) > 1:
+            binary = False
+
+    # without overviews a decimated read decodes every block anyway: go straight to the scan
+    if binary is None and decimation > 1 and file.overviews(1):
+        # overview values are resampled (e.g. averaged), so can only rule binary out
+        out_shape = (file.count, max(1, file.height // decimation), max(1, file.width // decimation))
+        if __outside(file.read(out_shape = out_shape)):
+            binary = False
+
+    if binary is None:
+        seen = set()
+        for _, window in file.block_windows(1):
+            block = file.read(window = window)
+            if ((block != 0) & (block != 1)).any():
+                binary = False
+                break
+            if len(seen) < 2:
+                seen.update(np.unique(block).tolist())
+        else:
+            binary = seen == set([0, 1])
+
+    if cache_key[1] is not None:
+        _binary_cache[cache_key] = binary
+
+    return(binary)
+
+
+class _Quiet(object):
+    "stands in for a yaspin spinner when output is suppressed"
+    text = ""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def ok(self, text):
+        pass
+
+def gt_pre(gt_file, output_dir, threshold = None, dst_crs = None, footprint = False, workers = None, quiet = False, footprint_mode = 'bbox', footprint_vertices = 200, cache = None):
+    """
+    threshold <gt_file> into <output_dir>/<name>_binary.tif (unless it is already binary) and, with <footprint>, write <output_dir>/<name>.geojson: the bounding box, or with footprint_mode = 'valid' the outline of the valid-data pixels in at most <footprint_vertices> vertices (see _valid_footprint). returns {'gt_file', 'binary', 'footprint', 'timings'} with the output paths and seconds spent per step. <quiet> suppresses the spinners.
 
-def gt_pre(gt_file, output_dir, threshold = None, dst_crs = None, footprint = False):
+    with <cache> (a gt_cache.GtCache), outputs are looked up by the input's content hash and these parameters first; on a hit they are placed in output_dir without reading any pixels, and fresh outputs are added to the cache.
+    """
+    spinner = (lambda text: _Quiet()) if quiet else (lambda text: yaspin(text = text, color = "yellow"))
+    timings = {}
     file_base = path.splitext(path.basename(gt_file))[0]
 
-    if not _is_binary_raster(gt_file):
+    cache_key = None
+    if cache is not None:
+        start = perf_counter()
+        cache_key = cache.key(gt_file, threshold = threshold, dst_crs = dst_crs, footprint = bool(footprint),
+                              footprint_mode = footprint_mode, footprint_vertices = footprint_vertices)
+        cached = cache.get(cache_key, output_dir, gt_file) if cache_key is not None else None
+        timings['cache'] = perf_counter() - start
+        if cached is not None:
+            if not quiet:
+                print("{} {}: outputs from cache".format(SUCCESS, gt_file))
+            cached['timings'] = timings
+            return cached
+
+    start = perf_counter()
+    binary = _is_binary_raster(gt_file)
+    timings['check'] = perf_counter() - start
+
+    if not binary:
         # not binary raster, so need a threshold
         if (threshold is None):
             raise Exception(f"{gt_file} is not a binary raster. Threshold required.")
 
-        with yaspin(text="thresholding raster...", color="yellow") as spinner:
+        with spinner("thresholding raster...") as spinner_:
+            start = perf_counter()
             binrast_file = path.join(output_dir, f"{file_base}_binary.tif")
-            _threshold_raster(gt_file, binrast_file, threshold, dst_crs)
-            spinner.text = "thresholding raster...done"
-            spinner.ok(SUCCESS)
+            if path.exists(binrast_file):
+                remove(binrast_file) # may be linked to a cache entry: never write through it
+            _threshold_raster(gt_file, binrast_file, threshold, dst_crs, workers)
+            timings['threshold'] = perf_counter() - start
+            spinner_.text = "thresholding raster...done"
+            spinner_.ok(SUCCESS)
 
     else:
         # input file is binary raster
         binrast_file = gt_file
 
+    vec_file = None
     if footprint:
         vec_filename = ".".join([file_base, 'geojson'])
-        with yaspin(text="writing vector footprint...", color="yellow") as spinner:
-            footprint = _footprint(gt_file)
-            
-            with open(path.join(output_dir, vec_filename), 'w') as vf:
+        vec_file = path.join(output_dir, vec_filename)
+        with spinner("writing vector footprint...") as spinner_:
+            start = perf_counter()
+            if footprint_mode == 'valid':
+                footprint = _valid_footprint(gt_file, max_vertices = footprint_vertices)
+            else:
+                footprint = _footprint(gt_file)
+
+            if path.exists(vec_file):
+                remove(vec_file)
+            with open(vec_file, 'w') as vf:
                 _gj = gpd.GeoSeries([footprint]).to_json()
                 vf.write(_gj)
-            spinner.text = "writing vector...done"
-            spinner.ok(SUCCESS)
+            timings['footprint'] = perf_counter() - start
+            spinner_.text = "writing vector...done"
+            spinner_.ok(SUCCESS)
+
+    outputs = {'gt_file' : gt_file, 'binary' : binrast_file, 'footprint' : vec_file, 'timings' : timings}
+    if cache_key is not None:
+        cache.put(cache_key, outputs, gt_file)
+
+    return(outputs)
+
+def _expand_gt_files(patterns):
+    "expand local and s3:// glob patterns; names without wildcards pass through"
+    files = []
+    for pattern in patterns:
+        if not any(c in pattern for c in "*?["):
+            files.append(pattern)
+        elif pattern.startswith("s3://"):
+            import s3fs
+            files += ["s3://" + f for f in sorted(s3fs.S3FileSystem().glob(pattern[5:]))]
+        else:
+            files += sorted(glob(pattern))
+
+    return files
+
+def _limit_memory(max_memory = None):
+    "cap this process's address space at max_memory MB, so a file that needs more raises MemoryError instead of exhausting the machine"
+    if max_memory is not None:
+        import resource
+        limit = int(max_memory * 1024 * 1024)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _gt_pre_job(gt_file, output_dir, threshold, dst_crs, footprint, max_memory = None, footprint_mode = 'bbox', footprint_vertices = 200, cache_dir = None, cache_size = None):
+    "process pool task: run gt_pre on one file of a batch, thresholding in-process, without spinners. returns its manifest entry"
+    _limit_memory(max_memory)
+
+    start = perf_counter()
+    try:
+        entry = gt_pre(gt_file, output_dir, threshold, dst_crs, footprint, workers = 1, quiet = True,
+                       footprint_mode = footprint_mode, footprint_vertices = footprint_vertices,
+                       cache = GtCache(cache_dir, cache_size) if cache_dir is not None else None)
+        entry['status'] = 'done'
+    except Exception as e:
+        entry = {'gt_file' : gt_file, 'status' : 'failed', 'error' : repr(e)}
+    entry['seconds'] = perf_counter() - start
+    return entry
+
+def gt_pre_batch(gt_files, output_dir, threshold = None, dst_crs = None, footprint = False, batch_workers = None, max_memory = None, manifest = None, footprint_mode = 'bbox', footprint_vertices = 200, cache_dir = None, cache_size = None):
+    """
+    gt_pre over many ground truth files (local or s3://) in a pool of <batch_workers> processes (default: one per cpu), each capped at <max_memory> MB of address space (see _limit_memory). files are thresholded block by block in their worker process.
 
-    return(0);
+    with <cache_dir>, every worker shares a gt_cache.GtCache there (limited to <cache_size> MB). each file's outputs, status ('done' or 'failed', with the error) and timings are appended as a JSON line to <manifest> (default: <output_dir>/gt_pre_manifest.jsonl) as it completes; a failing file does not stop the batch. returns the manifest entries.
+    """
+    if batch_workers is None:
+        batch_workers = cpu_count() or 1
+    if manifest is None:
+        manifest = path.join(output_dir, "gt_pre_manifest.jsonl")
+
+    entries = []
+    with futures.ProcessPoolExecutor(max_workers = max(1, min(batch_workers, len(gt_files)))) as executor, \
+         open(manifest, 'a') as mf:
+        jobs = {executor.submit(_gt_pre_job, gt_file, output_dir, threshold, dst_crs, footprint, max_memory,
+                                footprint_mode, footprint_vertices, cache_dir, cache_size): gt_file
+                for gt_file in gt_files}
+
+        for job in futures.as_completed(jobs):
+            try:
+                entry = job.result()
+            except Exception as e: # worker process died, e.g. killed for memory
+                entry = {'gt_file' : jobs[job], 'status' : 'failed', 'error' : repr(e)}
+
+            mf.write(json.dumps(entry) + "\n")
+            mf.flush()
+            entries.append(entry)
+            print("{} {} ({:.1f}s)".format(SUCCESS if entry['status'] == 'done' else FAIL,
+                                           entry['gt_file'], entry.get('seconds', 0)))
+
+    print("#files: {} | done: {}\tfailed: {}".format(len(entries),
+                                                     sum(e['status'] == 'done' for e in entries),
+                                                     sum(e['status'] == 'failed' for e in entries)))
+    return entries
 
 def main(args):
+    gt_files = _expand_gt_files(args.gt_file)
+    if not gt_files:
+        raise ValueError("no ground truth files match {}".format(" ".join(args.gt_file)))
+
     makedirs(args.output_dir, exist_ok = True)
-    return(gt_pre(args.gt_file,
+    if len(gt_files) > 1:
+        return(gt_pre_batch(gt_files,
+                            args.output_dir,
+                            args.threshold,
+                            args.dst_crs,
+                            args.footprint,
+                            args.batch_workers,
+                            args.max_memory,
+                            args.manifest,
+                            args.footprint_mode,
+                            args.footprint_vertices,
+                            args.cache_dir,
+                            args.cache_size))
+
+    return(gt_pre(gt_files[0],
                   args.output_dir,
                   args.threshold,
                   args.dst_crs,
-                  args.footprint))
+                  args.footprint,
+                  args.workers,
+                  footprint_mode = args.footprint_mode,
+                  footprint_vertices = args.footprint_vertices,
+                  cache = GtCache(args.cache_dir, args.cache_size) if args.cache_dir is not None else None))
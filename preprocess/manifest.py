@@ -0,0 +1,82 @@
+"""
+manifest
+
+persistent per-scene record of tiling outcomes (written, skipped, failed), used to resume interrupted tiling runs.
+"""
+
+import sqlite3
+import unittest
+
+from os import path
+from tempfile import TemporaryDirectory
+from time import time
+
+from mercantile import Tile
+
+class TestTileManifest(unittest.TestCase):
+    def test_record(self):
+        with TemporaryDirectory() as tmp:
+            manifest = TileManifest(path.join(tmp, "scene.manifest.sqlite"))
+            manifest.record([(Tile(1, 2, 15), 'written', 10, 'abc'),
+                             (Tile(2, 2, 15), 'skipped', 0, None),
+                             (Tile(3, 2, 15), 'failed', None, None)])
+            manifest.record([(Tile(3, 2, 15), 'written', 12, 'def')])
+
+            # committed as recorded: a run killed now would not lose them
+            other = sqlite3.connect(path.join(tmp, "scene.manifest.sqlite"))
+            self.assertEqual(other.execute("SELECT COUNT(*) FROM tiles").fetchone()[0], 3)
+            other.close()
+            manifest.close()
+
+            manifest = TileManifest(path.join(tmp, "scene.manifest.sqlite"))
+            self.assertEqual(manifest.done(), set([Tile(1, 2, 15), Tile(2, 2, 15), Tile(3, 2, 15)]))
+            self.assertEqual(manifest.summary(), {'written' : 2, 'skipped' : 1})
+            manifest.close()
+
+DONE = ('written', 'skipped')
+
+class TileManifest(object):
+    """
+    SQLite manifest of one scene's tiles: one row per tile with its latest status, size in bytes and md5 checksum of the written object. Rows are replaced when a tile is retried.
+
+    Not thread-safe; record from a single thread (tile_image records from the thread consuming pipeline results).
+
+    Uses SQLite's write-ahead log without a sync per commit, so committing every tile as it completes is cheap and survives the process being killed (not a power loss).
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tiles (
+                z INTEGER, x INTEGER, y INTEGER,
+                status TEXT,
+                size INTEGER,
+                checksum TEXT,
+                updated REAL,
+                PRIMARY KEY (z, x, y)
+            )""")
+        self.conn.commit()
+
+    def record(self, rows):
+        "record an iterable of (tile, status, size, checksum)"
+        now = time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(int(t.z), int(t.x), int(t.y), status, size, checksum, now)
+             for t, status, size, checksum in rows])
+        self.conn.commit()
+
+    def done(self):
+        "set of tiles already written or skipped as blank"
+        rows = self.conn.execute(
+            "SELECT x, y, z FROM tiles WHERE status IN (?, ?)", DONE)
+        return set(Tile(x, y, z) for x, y, z in rows)
+
+    def summary(self):
+        "tile count by status"
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM tiles GROUP BY status"))
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,202 @@
+"""
+retry
+
+delayed retries with exponential backoff and jitter for failed writes, with per-error-class policies and a dead-letter list for items that never succeed.
+"""
+
+import errno
+import heapq
+import random
+import socket
+import threading
+import unittest
+
+from collections import namedtuple
+from itertools import count
+from time import time
+
+class TestRetry(unittest.TestCase):
+    def test_backoff(self):
+        policy = RetryPolicy(max_attempts = 5, base_delay = 1.0, max_delay = 10.0)
+        for attempt in range(1, 8):
+            delay = backoff(policy, attempt)
+            self.assertTrue(0 <= delay <= min(10.0, 2 ** attempt))
+
+    def test_classify(self):
+        self.assertEqual(classify(ConnectionResetError()), 'transient')
+        self.assertEqual(classify(PermissionError()), 'fatal')
+        self.assertEqual(classify(OSError("503 SlowDown: please reduce your request rate")), 'throttled')
+
+        # as s3fs translates ClientErrors: errno only, the original as __cause__
+        self.assertEqual(classify(IOError(errno.EBUSY, "Please reduce your request rate.")), 'throttled')
+        self.assertEqual(classify(IOError(EREMOTEIO, "We encountered an internal error.")), 'transient')
+
+        cause = Exception("An error occurred (SlowDown)")
+        cause.response = {'Error' : {'Code' : 'SlowDown'}, 'ResponseMetadata' : {'HTTPStatusCode' : 503}}
+        translated = IOError(errno.EBUSY, "Please reduce your request rate.")
+        translated.__cause__ = cause
+        self.assertEqual(classify(translated), 'throttled')
+
+    def test_retry_queue(self):
+        attempts = {}
+        def flaky(item):
+            attempts[item] = attempts.get(item, 0) + 1
+            if item == 'never' or attempts[item] < 3:
+                raise ConnectionResetError(item)
+            return item.upper()
+
+        policies = dict(POLICIES, transient = RetryPolicy(4, 0.001, 0.01))
+        queue = RetryQueue(flaky, workers = 2, policies = policies)
+        queue.submit('ok', ConnectionResetError())
+        queue.submit('never', ConnectionResetError())
+        queue.submit('denied', PermissionError())
+        queue.join()
+
+        self.assertEqual(queue.done, [('ok', 'OK')])
+        self.assertEqual(sorted(item for item, _, _ in queue.dead_letter), ['denied', 'never'])
+        self.assertEqual(attempts, {'ok' : 3, 'never' : 3})
+
+    def test_max_pending(self):
+        pending = []
+        queue = RetryQueue(lambda item: pending.append(len(queue)), workers = 2, max_pending = 2,
+                           policies = dict(POLICIES, transient = RetryPolicy(2, 0.001, 0.01)))
+        for i in range(10):
+            queue.submit(i, ConnectionResetError())
+            self.assertLessEqual(len(queue), 2)
+        queue.join()
+
+        self.assertEqual(len(queue.done), 10)
+        self.assertLessEqual(max(pending), 2)
+
+RetryPolicy = namedtuple('RetryPolicy', ['max_attempts', 'base_delay', 'max_delay'])
+
+# max_attempts counts the original attempt
+POLICIES = {
+    'throttled' : RetryPolicy(max_attempts = 8, base_delay = 1.0, max_delay = 60.0),
+    'transient' : RetryPolicy(max_attempts = 5, base_delay = 0.5, max_delay = 30.0),
+    'fatal' : RetryPolicy(max_attempts = 1, base_delay = 0.0, max_delay = 0.0)
+}
+
+EREMOTEIO = getattr(errno, 'EREMOTEIO', 121)
+
+THROTTLE_CODES = ('SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequests')
+
+def classify(error):
+    """
+    error class of an exception raised by a write: 'throttled' (S3 503 SlowDown, 429), 'transient' (connection problems, timeouts, other 5xx, anything unknown) or 'fatal' (permissions, missing bucket, other 4xx, local disk errors).
+    """
+    # s3fs translates botocore ClientErrors into OSErrors raised from the original
+    response = getattr(error, 'response', getattr(error.__cause__, 'response', None))
+    if isinstance(response, dict):
+        code = response.get('Error', {}).get('Code', '')
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        if code in THROTTLE_CODES or status in (429, 503):
+            return 'throttled'
+        if 400 <= status < 500:
+            return 'fatal'
+        return 'transient'
+
+    # ...with an errno standing for the error code: EBUSY for SlowDown, EIO / EREMOTEIO for 5xx
+    if any(code in str(error) for code in THROTTLE_CODES):
+        return 'throttled'
+    if isinstance(error, OSError) and error.errno == errno.EBUSY:
+        return 'throttled'
+    if isinstance(error, OSError) and error.errno in (errno.EIO, EREMOTEIO):
+        return 'transient'
+    if isinstance(error, (ConnectionError, TimeoutError, socket.timeout)):
+        return 'transient'
+    if isinstance(error, OSError):
+        return 'fatal'
+
+    return 'transient'
+
+def backoff(policy, attempt):
+    "delay before retry number <attempt>: exponential backoff with full jitter"
+    return random.uniform(0, min(policy.max_delay, policy.base_delay * (2 ** attempt)))
+
+class RetryQueue(object):
+    """
+    Runs failed items again after a backoff delay, so waiting does not hold up the thread that hit the failure.
+
+    submit(item, error) schedules a retry according to the policy for the error's class (see classify, POLICIES); <workers> threads call func(item) once each item is due. Successes are collected in .done as (item, result); items that fail fatally or run out of attempts land in .dead_letter as (item, error message, attempts). join() waits for all items to settle.
+
+    With <max_pending>, submitting a new failure blocks while that many items are already waiting or being retried, so callers slow down instead of piling work up while the destination struggles (e.g. throttles).
+    """
+    def __init__(self, func, workers = 4, policies = POLICIES, max_pending = None):
+        self.func = func
+        self.policies = policies
+        self.max_pending = max_pending
+
+        self.done = []
+        self.dead_letter = []
+
+        self._heap = []
+        self._order = count()
+        self._active = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self._threads = [threading.Thread(target = self._work, daemon = True) for _ in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, item, error, attempt = 1):
+        "schedule a retry of <item>, which failed with <error> on try number <attempt>. returns False if it was dead-lettered instead. blocks first-time failures while max_pending items are pending"
+        policy = self.policies[classify(error)]
+        with self._cond:
+            if attempt >= policy.max_attempts:
+                self.dead_letter.append((item, repr(error), attempt))
+                return False
+
+            # retry workers resubmit their own items (attempt > 1): never block those
+            while attempt == 1 and self.max_pending is not None and len(self._heap) + self._active >= self.max_pending:
+                self._cond.wait()
+
+            due = time() + backoff(policy, attempt)
+            heapq.heappush(self._heap, (due, next(self._order), item, attempt))
+            self._cond.notify_all()
+            return True
+
+    def __len__(self):
+        "number of items waiting or being retried"
+        with self._cond:
+            return len(self._heap) + self._active
+
+    def _next(self):
+        "block until an item is due; None once closed and everything has settled"
+        with self._cond:
+            while True:
+                if self._heap and self._heap[0][0] <= time():
+                    _, _, item, attempt = heapq.heappop(self._heap)
+                    self._active += 1
+                    return item, attempt
+                if self._closed and not self._heap and self._active == 0:
+                    return None
+                self._cond.wait(timeout = (self._heap[0][0] - time()) if self._heap else None)
+
+    def _work(self):
+        while True:
+            due = self._next()
+            if due is None:
+                return
+
+            item, attempt = due
+            try:
+                result = self.func(item)
+                with self._cond:
+                    self.done.append((item, result))
+            except Exception as e:
+                self.submit(item, e, attempt + 1)
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    self._cond.notify_all()
+
+    def join(self):
+        "wait until every submitted item has succeeded or been dead-lettered, then stop the workers"
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+        for t in self._threads:
+            t.join()
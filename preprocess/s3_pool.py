@@ -0,0 +1,147 @@
+"""
+s3_pool
+
+pooled, reusable S3 filesystems for writing many small objects (e.g. tiles) from worker threads.
+"""
+
+import threading
+import unittest
+
+from os import environ
+from unittest.mock import patch
+
+import boto3
+import s3fs
+
+try:
+    from moto import mock_s3
+except ImportError:
+    try:
+        from moto import mock_aws as mock_s3 # moto >= 5
+    except ImportError:
+        mock_s3 = None
+
+try:
+    from moto.server import ThreadedMotoServer
+except ImportError:
+    ThreadedMotoServer = None
+
+_S3FS_VERSION = tuple(int(p) for p in s3fs.__version__.split(".")[:2] if p.isdigit())
+
+class TestS3Pool(unittest.TestCase):
+    def test_filesystem_per_thread(self):
+        pool = S3Pool()
+        fs = pool.filesystem()
+        self.assertIs(fs, pool.filesystem())
+
+        other = []
+        t = threading.Thread(target = lambda: other.append(pool.filesystem()))
+        t.start()
+        t.join()
+
+        self.assertIsNot(fs, other[0])
+        self.assertEqual(len(pool), 2)
+
+    @unittest.skipIf(mock_s3 is None and ThreadedMotoServer is None, "moto not installed")
+    def test_put(self):
+        if ThreadedMotoServer is None:
+            with mock_s3():
+                self._put(None)
+            return
+
+        # in-process mocks do not reach the aiobotocore clients of s3fs >= 0.5: serve over http instead
+        server = ThreadedMotoServer(ip_address = "127.0.0.1", port = 5123, verbose = False)
+        server.start()
+        try:
+            self._put("http://127.0.0.1:5123")
+        finally:
+            server.stop()
+
+    def _put(self, endpoint_url):
+        with patch.dict(environ, {'AWS_ACCESS_KEY_ID' : 'test', 'AWS_SECRET_ACCESS_KEY' : 'test', 'AWS_DEFAULT_REGION' : 'us-east-1'}):
+            client = boto3.client('s3', region_name = 'us-east-1', endpoint_url = endpoint_url)
+            client.create_bucket(Bucket = 'tiles')
+
+            pool = S3Pool(endpoint_url = endpoint_url)
+            pool.put("s3://tiles/15/1/2.tif", b"tile")
+
+            self.assertEqual(client.get_object(Bucket = 'tiles', Key = '15/1/2.tif')['Body'].read(), b"tile")
+
+class S3Pool(object):
+    """
+    Pool of s3fs filesystems, one per worker thread, created lazily on first use and kept for the life of the pool.
+
+    Each filesystem holds its own boto3 session and a connection pool of <pool_size> keep-alive connections, so repeated uploads from a thread reuse open connections instead of paying session creation and a TLS handshake per object. <endpoint_url> points the clients at an S3-compatible stand-in (moto server, MinIO).
+    """
+    def __init__(self, aws_profile = None, pool_size = 10, endpoint_url = None):
+        self.aws_profile = aws_profile
+        self.pool_size = pool_size
+        self.endpoint_url = endpoint_url
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._filesystems = []
+
+    def __len__(self):
+        return len(self._filesystems)
+
+    def _connect(self):
+        client_kwargs = {}
+        if self.endpoint_url is not None:
+            client_kwargs['endpoint_url'] = self.endpoint_url
+
+        # s3fs < 0.5 takes a boto3 session, later (aiobotocore) versions a profile name
+        if _S3FS_VERSION < (0, 5):
+            session_kwargs = {'session' : boto3.Session(profile_name = self.aws_profile)}
+        else:
+            session_kwargs = {'profile' : self.aws_profile}
+
+        # fsspec hands out one cached instance per set of arguments; each thread needs its own
+        return s3fs.S3FileSystem(client_kwargs = client_kwargs,
+                                 config_kwargs = {'max_pool_connections' : self.pool_size},
+                                 skip_instance_cache = True, **session_kwargs)
+
+    def filesystem(self):
+        "return the calling thread's filesystem, creating it on first use"
+        fs = getattr(self._local, 'fs', None)
+        if fs is None:
+            fs = self._connect()
+            self._local.fs = fs
+            with self._lock:
+                self._filesystems.append(fs)
+
+        return fs
+
+    def put(self, s3_path, data):
+        "write bytes <data> to <s3_path> (with or without s3:// prefix)"
+        with self.filesystem().open(_strip_scheme(s3_path), 'wb') as s3fp:
+            s3fp.write(data)
+
+    def put_file(self, local_path, s3_path):
+        "upload local file <local_path> to <s3_path>"
+        self.filesystem().put(local_path, _strip_scheme(s3_path))
+
+    def get_file(self, s3_path, local_path):
+        "download <s3_path> to <local_path>. returns False if the object does not exist"
+        fs = self.filesystem()
+        if not fs.exists(_strip_scheme(s3_path)):
+            return False
+        fs.get(_strip_scheme(s3_path), local_path)
+        return True
+
+def _strip_scheme(s3_path):
+    return s3_path[5:] if s3_path.startswith("s3://") else s3_path
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_pool(aws_profile = None, pool_size = 10, endpoint_url = None):
+    """
+    return the process-wide S3Pool for these settings, creating it on first use.
+    """
+    key = (aws_profile, pool_size, endpoint_url)
+    with _POOLS_LOCK:
+        if key not in _POOLS:
+            _POOLS[key] = S3Pool(aws_profile, pool_size, endpoint_url)
+
+        return _POOLS[key]
@@ -0,0 +1,93 @@
+"""
+stages
+
+a small producer/consumer runner: items flow through a chain of stages, each with its own pool of worker threads, joined by bounded queues so a slow stage applies backpressure to the ones before it.
+"""
+
+import threading
+import unittest
+
+from queue import Queue
+
+class TestStages(unittest.TestCase):
+    def test_run_stages(self):
+        stages = [
+            (lambda x: [x, x + 100], 2),
+            (lambda x: [x * 2], 3)
+        ]
+        out = list(run_stages(range(10), stages, queue_size = 2))
+
+        self.assertEqual(sorted(out), sorted([x * 2 for x in range(10)] + [(x + 100) * 2 for x in range(10)]))
+
+    def test_stage_error(self):
+        def fail(x):
+            if x == 3:
+                raise ValueError("bad item")
+            return [x]
+
+        with self.assertRaises(ValueError):
+            list(run_stages(range(5), [(fail, 2)]))
+
+_DONE = object()
+
+def run_stages(items, stages, queue_size = 32):
+    """
+    run <items> through <stages>, a list of (function, n_workers) pairs. each function takes one item and returns an iterable of items for the next stage (empty to drop the item). every queue between stages holds at most <queue_size> items.
+
+    yields the output of the last stage as it completes (in no particular order). if any stage function raises, the first exception is re-raised once the pipeline has drained.
+    """
+    queues = [Queue(maxsize = queue_size) for _ in range(len(stages) + 1)]
+    errors = []
+    lock = threading.Lock()
+
+    def feed():
+        try:
+            for item in items:
+                queues[0].put(item)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for _ in range(stages[0][1]):
+                queues[0].put(_DONE)
+
+    def work(i, func, remaining):
+        inq, outq = queues[i], queues[i + 1]
+        while True:
+            item = inq.get()
+            if item is _DONE:
+                break
+            try:
+                for out in func(item):
+                    outq.put(out)
+            except Exception as e:
+                errors.append(e)
+
+        # last worker out tells every worker of the next stage to stop
+        with lock:
+            remaining[0] -= 1
+            last = (remaining[0] == 0)
+        if last:
+            n_next = stages[i + 1][1] if i + 1 < len(stages) else 1
+            for _ in range(n_next):
+                outq.put(_DONE)
+
+    threads = [threading.Thread(target = feed, daemon = True)]
+    for i, (func, n_workers) in enumerate(stages):
+        remaining = [n_workers]
+        threads += [threading.Thread(target = work, args = (i, func, remaining), daemon = True)
+                    for _ in range(n_workers)]
+
+    for t in threads:
+        t.start()
+
+    while True:
+        out = queues[-1].get()
+        if out is _DONE:
+            break
+        yield out
+
+    for t in threads:
+        t.join()
+
+    if errors:
+        raise errors[0]
@@ -1,6 +1,15 @@
 import unittest
 
 from preprocess.gt_pre import TestGtPre
+from preprocess.tile import TestTile
+from preprocess.s3_pool import TestS3Pool
+from preprocess.stages import TestStages
+from preprocess.manifest import TestTileManifest
+from preprocess.tile_store import TestTileStore
+from preprocess.retry import TestRetry
+from preprocess.dataset_pool import TestDatasetPool
+from preprocess.timings import TestStageTimings
+from preprocess.gt_cache import TestGtCache
 
 
 if __name__ == "__main__":
@@ -1,28 +1,315 @@
 import argparse
 
+import unittest
+
 import pandas as pd
 import geopandas as gpd
 
 import rasterio as rio
-from mercantile import Tile, xy_bounds, bounds
+from mercantile import Tile, xy_bounds, bounds, parent
 from supermercado import burntiles
 
-from raster_utils import reproject_raster
-
-from rio_tiler.utils import tile_read
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds, transform_geom
+from affine import Affine
+from rasterio.enums import Resampling, ColorInterp
 
-from os import path, makedirs
+from os import path, makedirs, remove
 
 from functools import partial
+from itertools import groupby, chain
+from math import floor, ceil
+from collections import Counter, namedtuple
+
+import threading
 
 import numpy as np
 
-from time import sleep
+from os import cpu_count
 
 from concurrent import futures
 
-import s3fs
-import boto3
+from hashlib import md5
+
+from shapely.geometry import box, shape, mapping
+from shapely.ops import unary_union
+from shapely.prepared import prep
+
+from raster_utils import valid_footprint
+
+from preprocess.s3_pool import get_pool
+from preprocess.manifest import TileManifest
+from preprocess.tile_store import MBTilesWriter
+
+from tempfile import gettempdir
+from preprocess.stages import run_stages
+from preprocess.retry import RetryQueue
+from preprocess.dataset_pool import DatasetPool, gdal_options
+from preprocess.timings import StageTimings, format_summary
+
+from time import perf_counter
+
+class TestTile(unittest.TestCase):
+    def test_tile_strips(self):
+        tiles = [Tile(5, 9, 15), Tile(3, 8, 15), Tile(1, 8, 15), Tile(2, 8, 15), Tile(4, 8, 15)]
+
+        self.assertEqual(_tile_strips(tiles, strip_size = 2),
+                         [[Tile(1, 8, 15), Tile(2, 8, 15)],
+                          [Tile(3, 8, 15), Tile(4, 8, 15)],
+                          [Tile(5, 9, 15)]])
+
+        # non-adjacent tiles never share a strip
+        self.assertEqual(_tile_strips([Tile(1, 8, 15), Tile(3, 8, 15)]),
+                         [[Tile(1, 8, 15)], [Tile(3, 8, 15)]])
+
+    def test_nodata_fractions(self):
+        tile = Tile(0, 0, 1)
+        left, bottom, right, top = xy_bounds(tile)
+
+        data = np.ones((1, 64, 64), dtype = 'uint8')
+        data[:, :, 32:] = 0
+        profile = {
+            'driver' : 'GTiff', 'dtype' : 'uint8', 'count' : 1,
+            'height' : 64, 'width' : 64, 'nodata' : 0, 'crs' : 'EPSG:3857',
+            'transform' : rio.transform.from_bounds(left, bottom, right, top, 64, 64)
+        }
+
+        with rio.MemoryFile() as mf:
+            with mf.open(**profile) as dst:
+                dst.write(data)
+            with mf.open() as src:
+                fractions = _nodata_fractions(src, [tile, Tile(1, 0, 1)], decimation = 4)
+
+        self.assertAlmostEqual(fractions[tile], 0.5, places = 1)
+        self.assertEqual(fractions[Tile(1, 0, 1)], 1.0)
+
+    def test_cover_filter(self):
+        from tempfile import TemporaryDirectory
+
+        xyz = np.array([[1, 2, 15], [3, 4, 15], [3, 4, 14], [5, 6, 15]])
+        self.assertEqual(len(set(_quadkeys(xyz[:, 0], xyz[:, 1], xyz[:, 2]))), 4)
+
+        with TemporaryDirectory() as tmp:
+            cover = path.join(tmp, "cover.csv")
+            pd.DataFrame([[5, 6, 15], [3, 4, 15], [9, 9, 15]], columns = ['x', 'y', 'z']).to_csv(cover, index = False)
+
+            self.assertEqual(_cover_filter(cover, xyz, chunksize = 2).tolist(),
+                             [False, True, False, True])
+
+    def test_pyramid(self):
+        children = [Tile(0, 0, 2), Tile(1, 0, 2), Tile(0, 1, 2), Tile(1, 1, 2)]
+        pyramid = _Pyramid(children, [1])
+
+        mask = np.full((4, 4), 255, dtype = np.uint8)
+        for i, child in enumerate(children[:3]):
+            self.assertEqual(pyramid.add(child, np.full((1, 4, 4), i, dtype = np.uint16), mask), [])
+
+        # last child unreadable: its quadrant stays invalid
+        (tile, data, mask), = pyramid.add(children[3], None, None)
+        self.assertEqual(tile, Tile(0, 0, 1))
+        self.assertEqual(data[0, :, :].tolist(), [[0, 0, 1, 1], [0, 0, 1, 1], [2, 2, 0, 0], [2, 2, 0, 0]])
+        self.assertEqual(mask[2:, 2:].sum(), 0)
+        self.assertEqual(mask[:2, :].min(), 255)
+
+        # resumed: the parent was written before, only one child is read again
+        pyramid = _Pyramid(children[:1], [1], done = {Tile(0, 0, 1)})
+        self.assertEqual(pyramid.add(children[0], np.zeros((1, 4, 4), dtype = np.uint16), np.full((4, 4), 255, dtype = np.uint8)), [])
+
+    def test_read_strip_edge(self):
+        from tempfile import TemporaryDirectory
+        from mercantile import tiles as mercantile_tiles
+        from rasterio.warp import reproject
+        from preprocess.benchmark import synthetic_scene
+
+        with TemporaryDirectory() as tmp:
+            # no nodata value: only the warp knows where the image ends
+            scene = synthetic_scene(path.join(tmp, "scene.tif"), width = 512, height = 512, nodata = None)
+            with rio.open(scene) as src:
+                strip = _tile_strips(mercantile_tiles(*transform_bounds(src.crs, 'EPSG:4326', *src.bounds), 16))[0]
+                data, mask = _read_strip(src, strip, 256, [1])
+
+                left, _, _, top = xy_bounds(strip[0])
+                _, bottom, right, _ = xy_bounds(strip[-1])
+                inside = np.zeros(mask.shape, dtype = np.uint8)
+                reproject(np.ones((src.height, src.width), dtype = np.uint8), inside,
+                          src_transform = src.transform, src_crs = src.crs, dst_crs = 'EPSG:3857',
+                          dst_transform = rio.transform.from_bounds(left, bottom, right, top, mask.shape[1], mask.shape[0]))
+
+        # the northernmost strip runs past the image's top edge
+        self.assertGreater((inside == 0).sum(), 0)
+        self.assertGreater(((mask > 0) == (inside > 0)).mean(), 0.99)
+        self.assertEqual(data.shape, (1, 256, 256 * len(strip)))
+
+    def test_encode_nodata(self):
+        data = np.full((2, 16, 16), 5000, dtype = np.uint16)
+        data[:, :4, :] = 65535
+        mask = np.full((16, 16), 255, dtype = np.uint8)
+        mask[:4, :] = 0
+
+        # a quarter of the tile is nodata
+        self.assertIsNone(_encode_tile(Tile(0, 0, 15), data.copy(), mask, nodata_val = 65535, max_nodata_pct = 0.2))
+
+        tile_bytes = _encode_tile(Tile(0, 0, 15), data, mask, quant = 10000, nodata_val = 65535,
+                                  max_nodata_pct = 0.3, dtype = 'float32')
+        with rio.MemoryFile(tile_bytes) as mf:
+            with mf.open() as src:
+                encoded = src.read()
+
+        self.assertEqual(encoded.dtype, np.float32)
+        self.assertEqual(encoded[:, :4, :].max(), 0)
+        self.assertAlmostEqual(float(encoded[:, 4:, :].min()), 0.5)
+
+    # small synthetic scenes, tiled end to end at z16 (about 16 tiles each)
+    workers = {'read_workers' : 2, 'encode_workers' : 2, 'upload_workers' : 2}
+
+    def _scene(self, tmp, crs = 'EPSG:32611', nodata = 0):
+        from preprocess.benchmark import synthetic_scene
+        return synthetic_scene(path.join(tmp, "scene.tif"), width = 512, height = 512, crs = crs, nodata = nodata,
+                               res = 3.0 if crs != 'EPSG:3857' else 3.8)
+
+    def _written(self, result):
+        return set(tile for tile, written in result.tiles if written)
+
+    def test_tile_image(self):
+        from tempfile import TemporaryDirectory
+
+        for crs, nodata in [('EPSG:3857', 0), ('EPSG:32611', 0), ('EPSG:32611', None)]:
+            with self.subTest(crs = crs, nodata = nodata), TemporaryDirectory() as tmp:
+                scene, output_dir = self._scene(tmp, crs, nodata), path.join(tmp, "tiles")
+                result = tile_image(scene, output_dir, 16, max_nodata_pct = 0.5, **self.workers)
+                written = self._written(result)
+                self.assertGreater(len(written), 0)
+                self.assertLess(len(written), len(result.tiles)) # the scene's edges and nodata corner
+
+                with rio.open(scene) as src:
+                    for tile in written:
+                        with rio.open(path.join(output_dir, "16", str(tile.x), "{}.tif".format(tile.y))) as dst:
+                            self.assertEqual(dst.crs.to_epsg(), 4326)
+                            self.assertTrue(np.allclose(tuple(dst.bounds), tuple(bounds(tile))))
+                            data = dst.read()
+
+                        # strip reads give what reading the tile on its own gives (up to GDAL's warp
+                        # chunking, which moves a few bilinear samples next to nodata)
+                        expected, mask = _read_strip(src, [tile], bands = [1, 2, 3, 4])
+                        valid = mask > 0
+                        self.assertGreaterEqual(valid.mean(), 0.5)
+                        self.assertGreater((np.abs(data[:, valid].astype(int) - expected[:, valid]) <= 1).mean(), 0.99)
+                        self.assertEqual(data[:, ~valid].max(initial = 0), 0)
+
+    def test_tile_image_label(self):
+        from tempfile import TemporaryDirectory
+
+        with TemporaryDirectory() as tmp:
+            scene, label_file = self._scene(tmp), path.join(tmp, "label.tif")
+            with rio.open(scene) as src:
+                profile = dict(src.profile, count = 1, dtype = 'uint8', nodata = 255)
+                label = (src.read(1) > 4000).astype(np.uint8)
+            label[:, :256] = 255 # no ground truth over the west half
+            with rio.open(label_file, 'w', **profile) as dst:
+                dst.write(label, 1)
+
+            output_dir, label_dir = path.join(tmp, "tiles"), path.join(tmp, "labels")
+            result = tile_image(scene, output_dir, 16, label_file = label_file, label_output_dir = label_dir,
+                                max_nodata_pct = 0.5, **self.workers)
+            written = self._written(result)
+
+            alone = self._written(tile_image(scene, path.join(tmp, "alone"), 16, max_nodata_pct = 0.5, **self.workers))
+            self.assertGreater(len(written), 0)
+            self.assertLess(len(written), len(alone))
+
+            for tile in written:
+                self.assertTrue(path.exists(path.join(output_dir, "16", str(tile.x), "{}.tif".format(tile.y))))
+                with rio.open(path.join(label_dir, "16", str(tile.x), "{}.tif".format(tile.y))) as dst:
+                    self.assertEqual(dst.count, 1)
+                    self.assertTrue(set(np.unique(dst.read())) <= set([0, 1]))
+
+    def test_tile_image_footprint(self):
+        import json
+        from tempfile import TemporaryDirectory
+
+        with TemporaryDirectory() as tmp:
+            scene = self._scene(tmp)
+            with rio.open(scene) as src:
+                west, south, east, north = transform_bounds(src.crs, 'EPSG:4326', *src.bounds)
+            footprint_geom = box(west, (south + north) / 2, east, north)
+            footprint = path.join(tmp, "footprint.geojson")
+            with open(footprint, 'w') as f:
+                json.dump({'type' : 'FeatureCollection', 'features' : [
+                    {'type' : 'Feature', 'properties' : {}, 'geometry' : mapping(footprint_geom)}]}, f)
+
+            options = dict(self.workers, skip_blanks = False)
+            everything = set(t for t, _ in tile_image(scene, path.join(tmp, "all"), 16, **options).tiles)
+            touching = set(t for t, _ in tile_image(scene, path.join(tmp, "touching"), 16, footprint = footprint, **options).tiles)
+            mostly = set(t for t, _ in tile_image(scene, path.join(tmp, "mostly"), 16, footprint = footprint, min_overlap = 0.5, **options).tiles)
+
+        self.assertTrue(mostly < touching < everything)
+        for tile in mostly:
+            self.assertGreaterEqual(box(*bounds(tile)).intersection(footprint_geom).area, 0.5 * box(*bounds(tile)).area - 1e-12)
+
+    def test_open_store_staging(self):
+        from tempfile import TemporaryDirectory
+        from preprocess.tile_store import MBTilesReader
+
+        with TemporaryDirectory() as tmp:
+            manifest = path.join(tmp, "scene.manifest.sqlite")
+            store, store_file = _open_store("s3://bucket/scene.mbtiles", manifest = manifest)
+            store.put(Tile(1, 2, 15), b"old")
+            store.close() # then the run dies before uploading
+
+            store, again = _open_store("s3://bucket/scene.mbtiles", manifest = manifest)
+            store.close()
+            self.assertEqual(again, store_file)
+            self.assertEqual(len(MBTilesReader(store_file)), 0)
+
+    def test_tile_scenes(self):
+        from tempfile import TemporaryDirectory
+        from unittest import mock
+
+        calls = {}
+        def fake_tile_image(image, output_dir, **kwargs):
+            if image == "bad.tif":
+                raise IOError("unreadable")
+            calls[image] = kwargs
+            return TilingResult([], [], {})
+
+        settings = {'read_workers' : 2, 'upload_workers' : 4}
+        one_scene = _scene_memory(4, **_scene_limits(1, **settings))
+
+        with TemporaryDirectory() as tmp, mock.patch(__name__ + '.tile_image', fake_tile_image):
+            # memory for one scene of three: it runs alone, in this process, with every cpu
+            results = tile_scenes(["a.tif", "bad.tif", "c.tif"], tmp, scene_workers = 3, zoom = 16,
+                                  memory_budget = 1.5 * one_scene / 1024 / 1024, **settings)
+            self.assertIsNone(results["bad.tif"])
+            self.assertEqual(sorted(calls), ["a.tif", "c.tif"])
+            self.assertEqual(calls["a.tif"]['encode_workers'], max(1, cpu_count() or 1))
+
+            tile_scenes(["a.tif"], tmp, max_tiles = 40, zoom = 16, encode_workers = 2, **settings)
+            limits = {name : calls["a.tif"][name] for name in ['strip_size', 'read_workers', 'encode_workers', 'upload_workers', 'queue_size']}
+            self.assertLessEqual(_scene_tiles(**limits), 40)
+            self.assertGreaterEqual(limits['queue_size'], 1)
+
+        # max_tiles is shared between concurrent scenes, strips and retry queues included
+        self.assertLessEqual(3 * _scene_tiles(**_scene_limits(3, 300, encode_workers = 2)), 300)
+
+    def test_tile_image_resume(self):
+        from tempfile import TemporaryDirectory
+        from mercantile import tiles as mercantile_tiles
+
+        with TemporaryDirectory() as tmp:
+            scene, output_dir, manifest = self._scene(tmp), path.join(tmp, "tiles"), path.join(tmp, "scene.manifest.sqlite")
+            with rio.open(scene) as src:
+                first = list(mercantile_tiles(*transform_bounds(src.crs, 'EPSG:4326', *src.bounds), 16))[:4]
+            cover = path.join(tmp, "cover.csv")
+            pd.DataFrame([[t.x, t.y, t.z] for t in first], columns = ['x', 'y', 'z']).to_csv(cover, index = False)
+
+            done = tile_image(scene, output_dir, 16, cover = cover, manifest = manifest, max_nodata_pct = 0.5, **self.workers)
+            rest = tile_image(scene, output_dir, 16, manifest = manifest, resume = True, max_nodata_pct = 0.5, **self.workers)
+            again = tile_image(scene, output_dir, 16, manifest = manifest, resume = True, max_nodata_pct = 0.5, **self.workers)
+
+        self.assertEqual(set(t for t, _ in done.tiles), set(first))
+        self.assertGreater(len(rest.tiles), 0)
+        self.assertFalse(set(first) & set(t for t, _ in rest.tiles))
+        self.assertEqual(again.tiles, [])
 
 def add_parser(subparser):
     parser = subparser.add_parser(
@@ -34,64 +321,218 @@ def add_parser(subparser):
 
     parser.add_argument("output_dir", help="output directory. (AWS S3 and GCP GS compatible).")
 
+    parser.add_argument("--footprint", help="vector file (e.g. GeoJSON) of the images' valid-data footprint, or 'auto' to trace it from each image's nodata mask. only tiles intersecting it are produced. (Default: whole image bounding box)", default = None)
+
+    parser.add_argument("--min_overlap", help="with --footprint, minimum fraction of a tile's area inside the footprint", type = float, default = 0.0)
+
     parser.add_argument("--cover",
-                        help=".csv file containing x,y,z rows describing tiles to produce. (Default: completely cover an image)",
-                        type=argparse.FileType('r'))
+                        help=".csv file containing x,y,z rows describing tiles to produce, or a .npy array of the same. (Default: completely cover an image)")
 
     parser.add_argument("--zoom", help="OSM zoom level for tiles", type=int)
 
+    parser.add_argument("--zooms", help="several zoom levels written in one pass: the finest is read from the image, coarser levels are built by 2x2 downsampling. (Overrides --zoom)", nargs="+", type=int, default=None)
+
     parser.add_argument("--indexes", help='band indices to include in tile.', nargs="+", type=int, default = [1,2,3,4])
 
     parser.add_argument("--quant", help="value to divide bands with, if quantized", type = int, default = None)
 
+    parser.add_argument("--dtype", help="output tile dtype. native: read dtype (float64 after --quant); scaled: source integers with 1/quant stored as band scale", choices = OUTPUT_DTYPES, default = 'native')
+
+    parser.add_argument("--compress", help="GeoTIFF compression for output tiles", choices = ['none', 'deflate', 'lzw', 'zstd'], default = 'none')
+
+    parser.add_argument("--predictor", help="GeoTIFF predictor when compressing (Default: 2 for integer, 3 for float tiles)", type = int, choices = [1, 2, 3], default = None)
+
+    parser.add_argument("--blocksize", help="internal block size for tiled GeoTIFF output (multiple of 16). (Default: untiled)", type = int, default = None)
+
+    parser.add_argument("--container", help="write each scene's tiles into a single <scene>.mbtiles file instead of one file per z/x/y", choices = ['none', 'mbtiles'], default = 'none')
+
+    parser.add_argument("--mask", help="ground truth raster (e.g. gt_pre binary output) to tile paired with each image: only tiles where both image and mask pass the nodata check are written", default = None)
+
+    parser.add_argument("--mask_output_dir", help="directory for mask tiles, written to <mask_output_dir>/<mask basename>/. (Default: output_dir)", default = None)
+
     parser.add_argument("--aws_profile", help='aws profile name for s3:// destinations', default = None)
 
+    parser.add_argument("--s3_pool_size", help="keep-alive connections per pooled s3 client (one client per worker thread)", type = int, default = 10)
+
+    parser.add_argument("--s3_endpoint_url", help="alternate S3 endpoint for s3:// destinations (e.g. moto server, MinIO)", default = None)
+
+    parser.add_argument("--read_workers", help="threads reading strips from the source image", type = int, default = 4)
+
+    parser.add_argument("--encode_workers", help="threads checking and encoding tiles (Default: one per cpu)", type = int, default = None)
+
+    parser.add_argument("--gdal_cachemax", help="GDAL raster block cache size (MB) shared by the read workers of a scene process (Default: GDAL's own)", type = int, default = None)
+
+    parser.add_argument("--vsi_cache_size", help="per-handle read-ahead cache (MB) for s3:// source images; each read worker has its own handle (0 disables)", type = float, default = 0)
+
+    parser.add_argument("--upload_workers", help="threads writing encoded tiles to output_dir", type = int, default = 16)
+
+    parser.add_argument("--queue_size", help="maximum number of tiles waiting between pipeline stages", type = int, default = 32)
+
+    parser.add_argument("--retry_workers", help="threads retrying failed tile writes after exponential backoff with jitter", type = int, default = 4)
+
+    parser.add_argument("--scene_workers", help="number of scenes tiled concurrently, each in its own process", type = int, default = 1)
+
+    parser.add_argument("--max_tiles", help="maximum number of tiles in flight (strips being read, stage and retry queues, workers) across all concurrent scenes; lowers strip_size and queue_size to fit", type = int, default = None)
+
+    parser.add_argument("--memory_budget", help="approximate memory budget (MB) for in-flight tiles across all concurrent scenes; limits scene_workers", type = float, default = None)
+
+    parser.add_argument("--manifest_dir", help="directory for per-scene tile manifests (<scene>.manifest.sqlite). (Default: output_dir, or the current directory for s3:// output)", default = None)
+
+    parser.add_argument("--timings", help="write per-tile stage timings (read, nodata check, encode, upload) and bytes to <manifest_dir>/<scene>.timings.jsonl", action = 'store_true')
+
+    parser.add_argument("--resume", help="skip tiles the scene manifest lists as written or skipped; retry only failed or missing tiles", action = 'store_true')
+
     parser.add_argument("--skip-blanks", help="Skip blank tiles.", action = 'store_true')
 
     parser.add_argument("--max_nodata_pct", help="Maximum percentage of pixels with <nodata> value allowed", type = float, default = 0)
 
+    parser.add_argument("--strip_size", help="maximum number of adjacent tiles read from the source in a single windowed read", type = int, default = 16)
+
+    parser.add_argument("--blank_decimation", help="decimation factor of the mask read used to predict and skip blank tiles before reading them (0 disables)", type = int, default = 16)
+
+    parser.add_argument("--blank_margin", help="skip a tile before reading only if its predicted nodata fraction exceeds max_nodata_pct by this margin", type = float, default = 0.05)
+
     parser.add_argument("files", help="file or files to tile", nargs="+")
 
 
 
     parser.set_defaults(func = main)
 
-def _write_tile(tile, image, output_dir, tile_size = 512, bands = [1,2,3,4], quant = None, aws_profile = None, skip_blanks = True, nodata_val = 0, max_nodata_pct = 0.0):
+def _tile_strips(tiles, strip_size = 16):
     """
-        extracts and writes tile from image into output_dir, which can be s3://
+        groups tiles into strips of horizontally adjacent tiles (same z and y, consecutive x), each at most strip_size tiles wide. strips are ordered north to south, west to east.
 
     """
-    tile_xy_bounds = xy_bounds(tile)
-    tile_latlon_bounds = bounds(tile)
-    try: 
-        data, mask = tile_read(image, tile_xy_bounds, tile_size, indexes=bands)
-    except Exception as e:
-        print("failed to read tile")
-        return(tile, False)
-    
-    bands, height, width = data.shape
+    strips = []
+    ordered = sorted(tiles, key = lambda t: (t.z, t.y, t.x))
+    for _, row in groupby(ordered, key = lambda t: (t.z, t.y)):
+        strip = []
+        for tile in row:
+            if strip and (tile.x != strip[-1].x + 1 or len(strip) == strip_size):
+                strips.append(strip)
+                strip = []
+            strip.append(tile)
+        strips.append(strip)
+
+    return strips
+
+def _read_strip(image, strip, tile_size = 512, bands = [1,2,3,4], resampling = Resampling.bilinear):
+    """
+        reads a strip of adjacent tiles from image (an open dataset) with one warped, windowed read. returns (data, mask) with shapes (bands, tile_size, tile_size * len(strip)) and (tile_size, tile_size * len(strip)).
 
-    # does the number of cells with nodata exceed max_nodata_pct?
-    exceed_nodata_pct = ((np.sum(data == nodata_val) >
-                         (max_nodata_pct * data.size)))
+    """
+    left, _, _, top = xy_bounds(strip[0])
+    _, bottom, right, _ = xy_bounds(strip[-1])
+    width, height = tile_size * len(strip), tile_size
 
+    vrt_params = {
+        'crs' : 'EPSG:3857',
+        'transform' : rio.transform.from_bounds(left, bottom, right, top, width, height),
+        'width' : width,
+        'height' : height,
+        'resampling' : resampling
+    }
 
-    np.place(data, data == nodata_val, 0)
+    # mark pixels outside the image as invalid, via nodata if the image has one or an alpha band otherwise
+    alpha = None
+    if image.nodata is not None:
+        vrt_params.update(nodata = image.nodata, src_nodata = image.nodata)
+    elif ColorInterp.alpha in image.colorinterp:
+        alpha = image.colorinterp.index(ColorInterp.alpha) + 1
+    else:
+        vrt_params.update(add_alpha = True)
+        alpha = image.count + 1
 
-    if skip_blanks and exceed_nodata_pct:
-        print("Nodata ({}) in tile ({}), skipping...".format(nodata_val, tile))
-        return (tile, False)
+    if bands is None:
+        bands = [i for i in image.indexes if i != alpha]
 
-    if quant is not None:
-        data = data / quant
+    with WarpedVRT(image, **vrt_params) as vrt:
+        data = vrt.read(indexes = bands)
+        # a WarpedVRT's dataset_mask ignores its alpha band (every pixel reads as valid): use the alpha itself
+        if alpha is None:
+            mask = vrt.dataset_mask()
+        else:
+            mask = np.where(vrt.read(alpha) > 0, 255, 0).astype(np.uint8)
 
+    return data, mask
 
-    dirpath = path.join(output_dir, str(tile.z), str(tile.x)).replace('\0', "")
+def _split_strip(strip, data, mask, tile_size = 512):
+    """
+        yields (tile, data, mask) for each tile in a strip read by _read_strip. tile arrays are views into the strip arrays.
 
-    if(not dirpath.startswith("s3://")):
-        makedirs(dirpath, exist_ok=True)
+    """
+    for i, tile in enumerate(strip):
+        cols = slice(i * tile_size, (i + 1) * tile_size)
+        yield tile, data[:, :, cols], mask[:, cols]
 
-    tile_path = path.join(output_dir, str(tile.z), str(tile.x), "{}.{}".format(tile.y, "tif"))
+OUTPUT_DTYPES = ['native', 'uint16', 'float32', 'scaled']
+
+def _output_options(dtype, compress = None, predictor = None, blocksize = None):
+    """
+        GTiff creation options for a tile of numpy dtype <dtype>. predictor defaults to 2 (horizontal differencing) for integers and 3 (floating point) for floats when compressing.
+
+    """
+    options = {}
+    if compress is not None and compress != 'none':
+        options['compress'] = compress
+        if predictor is None:
+            predictor = 3 if np.issubdtype(dtype, np.floating) else 2
+        options['predictor'] = predictor
+
+    if blocksize is not None:
+        options.update(tiled = True, blockxsize = blocksize, blockysize = blocksize)
+
+    return options
+
+def _encode_tile(tile, data, mask, quant = None, skip_blanks = True, nodata_val = 0, max_nodata_pct = 0.0, dtype = None, compress = None, predictor = None, blocksize = None, timings = None):
+    """
+        encodes tile data (bands, height, width) as GeoTIFF bytes. returns None if the tile is skipped as blank.
+
+        dtype is one of OUTPUT_DTYPES: native (default) keeps the read dtype, or float64 after quant; uint16 and float32 cast to that type; scaled keeps the source integers and stores 1/quant as the band scale instead of dividing. compress (deflate, lzw, zstd), predictor and blocksize (internal tiling) are GTiff creation options (see _output_options).
+
+        nodata pixels are taken from mask (the dataset mask returned with the read; 0 is nodata) rather than by comparing data against nodata_val, and are zero-filled in the output. quant division and dtype casts write into a reused per-thread buffer (see _tile_buffer) instead of allocating new arrays per tile; without either, data is zero-filled in place.
+
+        if timings (a dict) is given, seconds spent on the nodata check and on encoding are added to its 'check' and 'encode' entries.
+
+    """
+    start = perf_counter()
+    tile_latlon_bounds = bounds(tile)
+
+    bands, height, width = data.shape
+
+    # does the fraction of nodata pixels exceed max_nodata_pct?
+    invalid = _invalid_pixels(data, mask, nodata_val)
+    n_invalid = np.count_nonzero(invalid)
+    exceed_nodata_pct = n_invalid > (max_nodata_pct * invalid.size)
+
+    checked = perf_counter()
+    if timings is not None:
+        _add_time(timings, 'check', checked - start)
+
+    if skip_blanks and exceed_nodata_pct:
+        print("Nodata ({}) in tile ({}), skipping...".format(nodata_val, tile))
+        return None
+
+    scales = None
+    if dtype == 'scaled' and quant is not None:
+        scales = [1.0 / quant] * bands
+    divide = quant is not None and dtype != 'scaled'
+
+    out_dtype = {'uint16' : np.uint16, 'float32' : np.float32}.get(dtype, np.float64 if divide else data.dtype)
+    if out_dtype == data.dtype and not divide:
+        out = data
+    else:
+        out = _tile_buffer(data.shape, out_dtype)
+        if divide:
+            np.divide(data, quant, out = out)
+        else:
+            if dtype == 'uint16' and not np.can_cast(data.dtype, np.uint16):
+                np.clip(data, 0, np.iinfo(np.uint16).max, out = data)
+            np.copyto(out, data, casting = 'unsafe')
+
+    if n_invalid:
+        out[:, invalid] = 0
+    data = out
 
     new_transform = rio.transform.from_bounds(*tile_latlon_bounds, width, height)
 
@@ -104,128 +545,733 @@ def _write_tile(tile, image, output_dir, tile_size = 512, bands = [1,2,3,4], qua
         'crs' : {'init' : 'epsg:4326'},
         'transform' : new_transform
     }
+    profile.update(_output_options(data.dtype, compress, predictor, blocksize))
+
+    with rio.MemoryFile() as tile_file:
+        with tile_file.open(**profile) as dst:
+            for band in range(0, bands ):
+                dst.write(data[band], band+1)
+            if scales is not None:
+                dst.scales = scales
+
+        tile_file.seek(0)
+        tile_bytes = tile_file.read()
+
+    if timings is not None:
+        _add_time(timings, 'encode', perf_counter() - checked)
+
+    return tile_bytes
+
+def _invalid_pixels(data, mask, nodata_val):
+    "(height, width) boolean array of nodata pixels: from the read mask, or where every band equals nodata_val if there is no mask"
+    if mask is not None:
+        return mask == 0
+    if nodata_val is None:
+        return np.zeros(data.shape[1:], dtype = bool)
+    return (data == nodata_val).all(axis = 0)
+
+_buffers = threading.local()
 
+def _tile_buffer(shape, dtype):
+    "the calling thread's reusable output array of <shape> and <dtype>. only valid until the thread's next call"
+    buffers = getattr(_buffers, 'arrays', None)
+    if buffers is None:
+        buffers = _buffers.arrays = {}
 
-#    try:
+    key = (shape, np.dtype(dtype))
+    if key not in buffers:
+        buffers[key] = np.empty(shape, dtype = dtype)
 
-    ## S3 DESTINATION - use memoryfile
-    using_memoryfile = False
-    if (tile_path.startswith('s3://')):
-        tile_file = rio.MemoryFile()
-        using_memoryfile = True
+    return buffers[key]
+
+def _add_time(timings, stage, seconds):
+    timings[stage] = timings.get(stage, 0.0) + seconds
+
+def _upload_tile(tile, tile_bytes, output_dir, s3_pool = None):
+    """
+        writes encoded tile into output_dir/z/x/y.tif, which can be s3:// (written through s3_pool, see s3_pool.S3Pool). errors are raised to the caller, which decides whether to retry (see retry.RetryQueue).
+
+    """
+    dirpath = path.join(output_dir, str(tile.z), str(tile.x)).replace('\0', "")
+
+    if(not dirpath.startswith("s3://")):
+        makedirs(dirpath, exist_ok=True)
+
+    tile_path = path.join(output_dir, str(tile.z), str(tile.x), "{}.{}".format(tile.y, "tif"))
+
+    ## LOCAL DESTINATION
+    if (not tile_path.startswith('s3://')):
+        with open(tile_path, 'wb') as dst:
+            dst.write(tile_bytes)
+        return True
+
+    ## S3 DESTINATION – write through the pooled s3 filesystem
+    s3_pool.put(tile_path, tile_bytes)
+
+    return True
+
+def _spread_bits(v):
+    "interleave zeros between the low 32 bits of uint64 array v"
+    v = v & np.uint64(0xFFFFFFFF)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF),
+                        (4, 0x0F0F0F0F0F0F0F0F), (2, 0x3333333333333333),
+                        (1, 0x5555555555555555)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+def _quadkeys(x, y, z):
+    """
+        packs tile coordinate arrays into uint64 quadkey integers: zoom in the top 6 bits, the interleaved bits of x and y (the quadkey digits) below. unique for z <= 29.
+
+    """
+    x, y, z = (np.asarray(a).astype(np.uint64) for a in (x, y, z))
+    return (z << np.uint64(58)) | _spread_bits(x) | (_spread_bits(y) << np.uint64(1))
+
+def _cover_chunks(cover, chunksize = 1000000):
+    """
+        yields (n, 3) integer arrays of x, y, z from a cover file: a csv (with a header row) read <chunksize> rows at a time, or a .npy array, memory-mapped.
+
+    """
+    if cover.endswith(".npy"):
+        rows = np.load(cover, mmap_mode = 'r')
+        for start in range(0, len(rows), chunksize):
+            yield np.asarray(rows[start:start + chunksize])
+        return
+
+    for chunk in pd.read_csv(cover, chunksize = chunksize):
+        if len(chunk.columns) != 3:
+            raise Exception("cover file needs to have 3 columns (x, y, z)")
+        yield chunk.values
+
+def _cover_filter(cover, xyz, chunksize = 1000000):
+    """
+        boolean mask over the rows of xyz ((n, 3) array of x, y, z) marking tiles present in cover (see _cover_chunks). cover is streamed, never fully materialized: each chunk is matched against the sorted quadkeys of xyz.
+
+    """
+    keys = _quadkeys(xyz[:, 0], xyz[:, 1], xyz[:, 2])
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+
+    found = np.zeros(len(keys), dtype = bool)
+    if len(keys) == 0:
+        return found
+
+    for chunk in _cover_chunks(cover, chunksize):
+        chunk_keys = _quadkeys(chunk[:, 0], chunk[:, 1], chunk[:, 2])
+        idx = np.searchsorted(sorted_keys, chunk_keys)
+        idx[idx == len(sorted_keys)] = 0
+        hits = idx[sorted_keys[idx] == chunk_keys]
+        found[order[hits]] = True
+
+    return found
+
+def _load_footprint(footprint, image, decimation = 16):
+    """
+        valid-data footprint of image as a shapely geometry in EPSG:4326: read from a vector file (e.g. GeoJSON), or traced from the image's decimated nodata mask when footprint == 'auto' (see raster_utils.valid_footprint).
+
+    """
+    if footprint == 'auto':
+        geom = valid_footprint(image, decimation)
+        return shape(transform_geom(image.crs, 'EPSG:4326', mapping(geom)))
+
+    gdf = gpd.read_file(footprint)
+    if gdf.crs:
+        gdf = gdf.to_crs({'init': 'epsg:4326'})
+    return unary_union(gdf.geometry.values)
+
+def _burn_footprint(footprint, zoom, min_overlap = 0.0):
+    """
+        (n, 3) array of x, y, z of the tiles at zoom that intersect footprint (shapely geometry, EPSG:4326). with min_overlap > 0, only tiles with at least that fraction of their area inside footprint are kept.
+
+    """
+    polygons = getattr(footprint, 'geoms', [footprint])
+    features = [{'type' : 'Feature', 'properties' : {}, 'geometry' : mapping(p)}
+                for p in polygons if not p.is_empty and p.geom_type == 'Polygon']
+    if not features:
+        return np.zeros((0, 3), dtype = int)
+
+    burned = burntiles.burn(features, zoom)
+    if min_overlap <= 0:
+        return burned
+
+    inside = prep(footprint)
+    keep = np.zeros(len(burned), dtype = bool)
+    for i, (x, y, z) in enumerate(burned.tolist()):
+        tile_box = box(*bounds(x, y, z))
+        keep[i] = (inside.contains(tile_box) or
+                   tile_box.intersection(footprint).area >= min_overlap * tile_box.area)
+
+    return burned[keep]
+
+def _nodata_fractions(image, tiles, decimation = 16):
+    """
+        estimates each tile's nodata fraction from a single decimated read of image's dataset mask. area outside the image counts as nodata. returns {tile: fraction}
+
+    """
+    height = max(1, image.height // decimation)
+    width = max(1, image.width // decimation)
+
+    valid = image.dataset_mask(out_shape = (height, width)) > 0
+    transform = image.transform * Affine.scale(image.width / width, image.height / height)
+
+    fractions = {}
+    for tile in tiles:
+        tile_bounds = transform_bounds('EPSG:3857', image.crs, *xy_bounds(tile))
+        window = rio.windows.from_bounds(*tile_bounds, transform = transform)
+
+        row_start, col_start = floor(window.row_off), floor(window.col_off)
+        row_stop = max(ceil(window.row_off + window.height), row_start + 1)
+        col_stop = max(ceil(window.col_off + window.width), col_start + 1)
+        total = (row_stop - row_start) * (col_stop - col_start)
+
+        n_valid = valid[max(row_start, 0):max(row_stop, 0),
+                        max(col_start, 0):max(col_stop, 0)].sum()
+
+        fractions[tile] = 1.0 - n_valid / total
+
+    return fractions
+
+class _Pyramid(object):
+    """
+        builds coarser zoom levels from tiles of the finest zoom as they are read. each child is averaged 2x2 (ignoring invalid pixels) into its quadrant of the parent; once all of a parent's expected children are in, the parent is complete and fed upward in turn. only levels in <zooms> are emitted.
+
+        <tiles> are the finest-zoom tiles that will be read; children that never arrive must be reported with add(tile, None, None) so their parents still complete. parents in <done> (e.g. already written, on resume) are still built and fed upward but not emitted, since they may be missing the children that were not read again.
+    """
+    def __init__(self, tiles, zooms, nodata = None, done = ()):
+        self.zooms = set(zooms)
+        self.nodata = nodata
+        self.done = done
+        self._min_zoom = min(self.zooms)
+
+        self._expected = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        level = set(tiles)
+        for z in range(max(t.z for t in level) - 1 if level else 0, min(self.zooms) - 1, -1):
+            parents = Counter(parent(t) for t in level)
+            self._expected.update(parents)
+            level = set(parents)
+
+    def add(self, tile, data, mask):
+        "add a tile (data None if unreadable); returns [(tile, data, mask)] of completed parents in zooms"
+        completed = []
+        with self._lock:
+            while tile.z > self._min_zoom and parent(tile) in self._expected:
+                up = parent(tile)
+                acc = self._accumulate(up, tile, data, mask)
+                if acc['n'] < self._expected[up]:
+                    break
+
+                del self._pending[up]
+                tile, data, mask = up, acc['data'], acc['mask']
+                if acc['data'] is not None and up.z in self.zooms and up not in self.done:
+                    completed.append((tile, data, mask))
+
+        return completed
+
+    def _accumulate(self, up, tile, data, mask):
+        acc = self._pending.setdefault(up, {'n' : 0, 'data' : None, 'mask' : None})
+        acc['n'] += 1
+        if data is None:
+            return acc
+
+        bands, size, _ = data.shape
+        half = size // 2
+        if acc['data'] is None:
+            acc['data'] = np.full((bands, size, size), self.nodata or 0, dtype = data.dtype)
+            acc['mask'] = np.zeros((size, size), dtype = np.uint8)
+
+        valid = (mask > 0).reshape(half, 2, half, 2)
+        count = valid.sum(axis = (1, 3))
+        total = (data * valid.reshape(size, size)).reshape(bands, half, 2, half, 2).sum(axis = (2, 4))
+
+        rows = slice((tile.y - 2 * up.y) * half, (tile.y - 2 * up.y + 1) * half)
+        cols = slice((tile.x - 2 * up.x) * half, (tile.x - 2 * up.x + 1) * half)
+        has_data = count > 0
+        acc['data'][:, rows, cols][:, has_data] = (total[:, has_data] / count[has_data]).astype(data.dtype)
+        acc['mask'][rows, cols][has_data] = 255
+
+        return acc
+
+# --- tiling pipeline stages (see stages.run_stages). each tile travels as a
+# record dict; once a stage sets record['status'] later stages pass it through.
+
+def _read_stage(strip, image, tile_size = 512, bands = [1,2,3,4], pyramid = None, label_image = None):
+    """
+    read a strip in one read and emit one record per tile, plus any pyramid parents the strip completes. with label_image (a co-registered ground truth raster), the same strip is read from it too (nearest resampling) into each record's label and label_mask.
+
+    image and label_image are dataset_pool.DatasetPools: each read worker reads through its own handle. each tile's record gets its share of the strip's read time as timings['read'].
+    """
+    start = perf_counter()
+    try:
+        data, mask = _read_strip(image.dataset(), strip, tile_size, bands)
+        if label_image is not None:
+            label_data, label_mask = _read_strip(label_image.dataset(), strip, tile_size, [1], Resampling.nearest)
+            labels = _split_strip(strip, label_data, label_mask, tile_size)
+    except Exception as e:
+        print("failed to read strip ({} - {}): {}".format(strip[0], strip[-1], e))
+        records = [{'tile' : tile, 'status' : 'failed', 'timings' : {'read' : (perf_counter() - start) / len(strip)}}
+                   for tile in strip]
+        if pyramid is not None:
+            for tile in strip:
+                records += [{'tile' : t, 'data' : d, 'mask' : m, 'status' : None}
+                            for t, d, m in pyramid.add(tile, None, None)]
+        return records
+
+    read_time = (perf_counter() - start) / len(strip)
+
+    records = []
+    for tile, tile_data, tile_mask in _split_strip(strip, data, mask, tile_size):
+        records.append({'tile' : tile, 'data' : tile_data, 'mask' : tile_mask, 'status' : None,
+                        'timings' : {'read' : read_time}})
+        if label_image is not None:
+            _, records[-1]['label'], records[-1]['label_mask'] = next(labels)
+        if pyramid is not None:
+            records += [{'tile' : t, 'data' : d, 'mask' : m, 'status' : None}
+                        for t, d, m in pyramid.add(tile, tile_data, tile_mask)]
+
+    return records
+
+def _encode_stage(record, label_nodata = None, **kwargs):
+    """
+    nodata check and GeoTIFF encode; drops pixel arrays from the record. a record with a label is encoded as a pair (label first, it is a single band): if either side is blank both are skipped. labels are written in their own dtype, without quant.
+    """
+    if record['status'] is not None:
+        return [record]
+
+    data, mask = record.pop('data'), record.pop('mask')
+    timings = record.setdefault('timings', {})
+    try:
+        if 'label' in record:
+            label_kwargs = dict(kwargs, quant = None, dtype = None, nodata_val = label_nodata)
+            record['label_bytes'] = _encode_tile(record['tile'], record.pop('label'), record.pop('label_mask'), timings = timings, **label_kwargs)
+            if record['label_bytes'] is None:
+                record['status'] = 'skipped'
+                return [record]
+
+        record['bytes'] = _encode_tile(record['tile'], data, mask, timings = timings, **kwargs)
+    except Exception as e:
+        print("failed to encode tile ({}): {}".format(record['tile'], e))
+        record['status'] = 'failed'
+        return [record]
+
+    if record['bytes'] is None:
+        record['status'] = 'skipped'
+
+    return [record]
+
+def _write_encoded(tile, tile_bytes, output_dir, s3_pool = None, store = None):
+    "write encoded bytes to output_dir, or into store (a tile_store.MBTilesWriter) if given"
+    if store is not None:
+        store.put(tile, tile_bytes)
+        return True
+
+    return _upload_tile(tile, tile_bytes, output_dir, s3_pool)
+
+def _write_record(record, output_dir, s3_pool = None, store = None, label_output_dir = None, label_store = None):
+    """
+    write a record's encoded bytes (and label bytes, for pairs) to their outputs and mark it written. raises on failure, leaving the bytes in the record so it can be retried. time spent, failed attempts included, is added to timings['upload'].
+    """
+    start = perf_counter()
+    try:
+        _write_encoded(record['tile'], record['bytes'], output_dir, s3_pool, store)
+        if record.get('label_bytes') is not None:
+            _write_encoded(record['tile'], record['label_bytes'], label_output_dir, s3_pool, label_store)
+            record['label_size'] = len(record['label_bytes'])
+    finally:
+        _add_time(record.setdefault('timings', {}), 'upload', perf_counter() - start)
+
+    tile_bytes = record.pop('bytes')
+    record.pop('label_bytes', None)
+    record['status'] = 'written'
+    record['size'] = len(tile_bytes)
+    record['checksum'] = md5(tile_bytes).hexdigest()
+    return record
+
+def _upload_stage(record, retries = None, **kwargs):
+    """
+    write a record (see _write_record). a failed write is handed to <retries> (a retry.RetryQueue) and leaves the pipeline; it comes back out of the queue once written or dead-lettered (see _settle_retries). without retries it is marked failed.
+    """
+    if record['status'] is not None:
+        return [record]
+
+    try:
+        return [_write_record(record, **kwargs)]
+    except Exception as e:
+        if retries is not None:
+            retries.submit(record, e)
+            return []
+
+        print("failed to write tile ({}): {}".format(record['tile'], e))
+        record.pop('bytes', None)
+        record.pop('label_bytes', None)
+        record['status'] = 'failed'
+        return [record]
+
+def _settle_retries(retries):
+    "wait for the retry queue to drain, then emit its records: written ones, and dead-lettered ones marked failed"
+    retries.join()
+
+    for record, _ in retries.done:
+        yield record
+
+    for record, error, attempts in retries.dead_letter:
+        print("giving up on tile ({}) after {} attempt(s): {}".format(record['tile'], attempts, error))
+        record.pop('bytes', None)
+        record.pop('label_bytes', None)
+        record['status'] = 'failed'
+        yield record
+
+def _open_store(output_dir, s3_pool = None, manifest = None, resume = False):
+    """
+    open an MBTilesWriter for an output_dir ending in .mbtiles (else returns None, None). s3:// containers are staged locally, next to the manifest if there is one (started afresh unless resuming), and uploaded by _close_store. returns (store, local file)
+    """
+    if not output_dir.endswith(".mbtiles"):
+        return None, None
+
+    store_file = output_dir
+    if output_dir.startswith("s3://"):
+        staging_dir = path.dirname(manifest) if manifest is not None else gettempdir()
+        store_file = path.join(staging_dir, path.basename(output_dir))
+        if resume and not path.exists(store_file):
+            s3_pool.get_file(output_dir, store_file)
+        elif not resume:
+            # a staging file left by an earlier run would carry its tiles into this upload
+            for stale in [store_file, store_file + "-wal", store_file + "-shm"]:
+                if path.exists(stale):
+                    remove(stale)
     else:
-        tile_file = tile_path
+        makedirs(path.dirname(output_dir) or ".", exist_ok = True)
 
-    # write data to file, either on disk or memoryfile
-    with rio.open(tile_file, 'w', **profile) as dst:
-        for band in range(0, bands ):
-            dst.write(data[band], band+1)
+    return MBTilesWriter(store_file), store_file
 
-    # need to seek mf for reading
-    if (using_memoryfile):
-        tile_file.seek(0)
+def _close_store(store, store_file, output_dir, s3_pool = None):
+    if store is None:
+        return
+
+    store.close()
+    if output_dir.startswith("s3://"):
+        s3_pool.put_file(store_file, output_dir)
 
-    ## S3 DESTINATION – write memoryfile with s3fs
-    if (tile_path.startswith('s3://')):
-        # strip "s3://"
-        tile_path = tile_path[5:]
-        # open s3 Session
-        session = boto3.Session(profile_name = aws_profile)
-        fs = s3fs.S3FileSystem(session =  session)
-        # open file , write file
-        s3fp = fs.open(tile_path, 'wb')
-        try:
-            s3fp.write(tile_file.read())
-        except Exception as e:
-            sleep(5)
-            try: 
-                s3fp.write(tile_file.read())
-            except Exception as e: 
-                return tile, False
-            
-
-            
-        # close fps
-        s3fp.close()
-        tile_file.close()
-
-#     except Exception as e:
-#         print(e)
-#         return tile, False
-
-    return tile, True
-
-
-def tile_image(imageFile, output_dir, zoom, cover=None, indexes = None, quant = None, aws_profile = None, skip_blanks = True, max_nodata_pct = 0.0):
+
+# tile_image results: [(tile, written)], [(tile, last error, attempts)] for writes given up on, and per-stage timing percentiles
+TilingResult = namedtuple('TilingResult', ['tiles', 'dead_letter', 'timings'])
+
+def tile_image(imageFile, output_dir, zoom, cover=None, indexes = None, quant = None, aws_profile = None, skip_blanks = True, max_nodata_pct = 0.0, strip_size = 16, s3_pool_size = 10, s3_endpoint_url = None, read_workers = 4, encode_workers = None, upload_workers = 16, queue_size = 32, manifest = None, resume = False, blank_decimation = 16, blank_margin = 0.05, dtype = None, compress = None, predictor = None, blocksize = None, zooms = None, label_file = None, label_output_dir = None, footprint = None, min_overlap = 0.0, retry_workers = 4, gdal_cachemax = None, vsi_cache_size = None, timings_file = None):
     """
     Produce either A) all tiles covering <image> at <zoom> or B) all tiles in <cover> if <cover> is not None at <zoom> and place OSM directory structure in <imageFile>/Z/X/Y.png format inside output_dir. If quant, divide all bands by Quant first. Can write to s3:// destinations with aws_profile.
 
+    Other options choose the tiles (<zooms>: coarser levels built from the finest, see _Pyramid; <footprint>, <min_overlap>: see _burn_footprint; <label_file>: paired ground truth tiles in <label_output_dir>), their encoding (see _encode_tile) and container (an output_dir ending in .mbtiles, see _open_store). Strips are read, encoded and uploaded by pools of worker threads (see _read_stage, stages.run_stages), with failed writes retried (see retry.RetryQueue). With <manifest>, each tile's outcome is recorded, and <resume> skips finished tiles.
+
+    Returns a TilingResult: (tile, written) pairs, dead-lettered writes and per-stage timings.
     """
-    from shapely.geometry import box
     from json import loads
     from supermercado import burntiles
 
-    def __load_cover_tiles(coverfile):
-        coverTiles = pd.read_csv(coverfile)
-        if len(coverTiles.columns) != 3:
-            raise Exception("cover file needs to have 3 columns (z, x, y)")
+    if encode_workers is None:
+        encode_workers = cpu_count() or 1
 
-        return [Tile(z, x, y) for _, (z, x, y) in list(coverTiles.iterrows())]
+    if dtype == 'uint16' and quant is not None:
+        raise ValueError("uint16 output would truncate quant-divided values; use float32 or scaled")
 
 
-    f = None
+    env_options = gdal_options(gdal_cachemax, vsi_cache_size)
     if (imageFile.startswith("s3://")):
-        with rio.Env(profile_name = aws_profile):
-            f = rio.open(imageFile)
-    else:
-        f = rio.open(imageFile)
+        env_options['profile_name'] = aws_profile
 
-    # check crs:
-    if int(f.crs.to_dict()['init'].split(":")[1]) != 4326:
-        print(f"invalid crs ({f.crs.to_dict()['init']}), reprojecting raster....")
-        f.close()
-        mf = rio.io.MemoryFile()
-        reproject_raster(imageFile, 4326, mf)
-        mf.seek(0)
-
-        f = mf.open()
+    with rio.Env(**env_options):
+        f = rio.open(imageFile)
 
-        print(f"reproject successful {f.crs.to_dict()}")
+    # no up-front reprojection: each strip read warps just its own window
+    # from the source crs onto the web mercator tile grid (see _read_strip)
+    scene_bounds = transform_bounds(f.crs, 'EPSG:4326', *f.bounds)
 
-    bbox = box(f.bounds.left, f.bounds.bottom, f.bounds.right, f.bounds.top)
+    bbox = box(*scene_bounds)
     bbox = loads(gpd.GeoSeries(bbox).to_json())['features'] # need geojson dict
 
-    tiles = [Tile(z, x, y) for z, x, y in burntiles.burn(bbox, zoom)]
+    pyramid_zooms = []
+    if zooms:
+        zoom = max(zooms)
+        pyramid_zooms = sorted(set(z for z in zooms if z < zoom))
 
+    if footprint is not None:
+        footprint_geom = _load_footprint(footprint, f, blank_decimation or 16).intersection(box(*scene_bounds))
+        burned = _burn_footprint(footprint_geom, zoom, min_overlap)
+        print("footprint covers {} tiles at z{}".format(len(burned), zoom))
+    else:
+        burned = burntiles.burn(bbox, zoom)
 
-    covertiles = set()
     if cover is not None:
-        covertiles = set(__load_cover_tiles(cover))
-        tiles = set(tiles).intersection(covertiles)
+        burned = burned[_cover_filter(cover, burned)]
+
+    label = None
+    if label_file is not None:
+        if zooms:
+            raise ValueError("paired image/label tiling does not support --zooms")
+        with rio.Env(**env_options):
+            label = rio.open(label_file)
+        label_bbox = box(*transform_bounds(label.crs, 'EPSG:4326', *label.bounds))
+        label_burned = burntiles.burn(loads(gpd.GeoSeries(label_bbox).to_json())['features'], zoom)
+        burned = burned[np.isin(_quadkeys(burned[:, 0], burned[:, 1], burned[:, 2]),
+                                _quadkeys(label_burned[:, 0], label_burned[:, 1], label_burned[:, 2]))]
+
+    tiles = [Tile(x, y, z) for x, y, z in burned.tolist()]
+
+
+    done = set()
+    tile_manifest = None
+    if manifest is not None:
+        tile_manifest = TileManifest(manifest)
+        if resume:
+            done = tile_manifest.done()
+            # with a pyramid, a tile is only finished once every coarser level built from it is
+            tiles = [t for t in tiles
+                     if t not in done or any(Tile(t.x >> (t.z - z), t.y >> (t.z - z), z) not in done
+                                             for z in pyramid_zooms)]
+            print("resuming from {}: {} tiles done, {} to go".format(manifest, len(done), len(tiles)))
+
+    # tiles predicted blank (nodata fraction over max_nodata_pct + blank_margin) are skipped unread.
+    # not with a pyramid: a parent averages whatever its children hold, so every tile is read
+    blanks = []
+    if skip_blanks and f.nodata is not None and blank_decimation and not pyramid_zooms:
+        fractions = _nodata_fractions(f, tiles, blank_decimation)
+        blanks = [t for t in tiles if fractions[t] > max_nodata_pct + blank_margin]
+        tiles = [t for t in tiles if fractions[t] <= max_nodata_pct + blank_margin]
+        print("predicted {} blank tiles from {}x decimated mask, skipping before read".format(len(blanks), blank_decimation))
+
+    if skip_blanks and label is not None and label.nodata is not None and blank_decimation:
+        fractions = _nodata_fractions(label, tiles, blank_decimation)
+        blanks += [t for t in tiles if fractions[t] > max_nodata_pct + blank_margin]
+        tiles = [t for t in tiles if fractions[t] <= max_nodata_pct + blank_margin]
+
+    strips = _tile_strips(tiles, strip_size)
+
+    pyramid = None
+    if pyramid_zooms:
+        pyramid = _Pyramid(tiles, pyramid_zooms, f.nodata, done)
+
+    s3_pool = None
+    if output_dir.startswith("s3://") or (label_output_dir or "").startswith("s3://"):
+        s3_pool = get_pool(aws_profile, s3_pool_size, s3_endpoint_url)
+
+    store, store_file = _open_store(output_dir, s3_pool, manifest, resume)
+
+    label_store, label_store_file = None, None
+    if label_file is not None:
+        label_store, label_store_file = _open_store(label_output_dir, s3_pool, manifest, resume)
+
+    images = DatasetPool(imageFile, env_options)
+    labels = DatasetPool(label_file, env_options) if label is not None else None
+
+    write_kwargs = dict(output_dir = output_dir, s3_pool = s3_pool, store = store,
+                        label_output_dir = label_output_dir, label_store = label_store)
+    # a full retry queue blocks the upload workers, which backs up the bounded stage queues
+    retries = RetryQueue(partial(_write_record, **write_kwargs), retry_workers, max_pending = queue_size)
+
+    stages = [
+        (partial(_read_stage, image = images, bands = indexes, pyramid = pyramid, label_image = labels), read_workers),
+        (partial(_encode_stage, quant = quant,
+                 label_nodata = label.nodata if label is not None else None,
+                 skip_blanks = skip_blanks, nodata_val = f.nodata,
+                 max_nodata_pct = max_nodata_pct, dtype = dtype,
+                 compress = compress, predictor = predictor,
+                 blocksize = blocksize), encode_workers),
+        (partial(_upload_stage, retries = retries, **write_kwargs), upload_workers)
+    ]
+
+    stage_timings = StageTimings(timings_file)
+
+    responses = []
+    # GDAL_CACHEMAX is process-wide: it has to stay set while the workers read, not just while they open
+    with rio.Env(**env_options):
+        for r in chain(({'tile' : t, 'status' : 'skipped'} for t in blanks),
+                       run_stages(strips, stages, queue_size),
+                       _settle_retries(retries)):
+            responses.append((r['tile'], r['status'] == 'written'))
+            stage_timings.add(r['tile'], r['status'], r.get('timings', {}), r.get('size', 0) + r.get('label_size', 0))
+            # recorded as each tile completes, so a killed run loses none of them on resume
+            if tile_manifest is not None:
+                tile_manifest.record([(r['tile'], r['status'], r.get('size', 0), r.get('checksum'))])
+
+    images.close()
+    if labels is not None:
+        labels.close()
+
+    _close_store(store, store_file, output_dir, s3_pool)
+    if label_file is not None:
+        _close_store(label_store, label_store_file, label_output_dir, s3_pool)
+
+    if tile_manifest is not None:
+        tile_manifest.close()
+
+    dead_letter = [(record['tile'], error, attempts) for record, error, attempts in retries.dead_letter]
+    stage_timings.close()
+    result = TilingResult(responses, dead_letter, stage_timings.summary())
+
+    if not responses:
+        print("#tiles: 0")
+        return(result)
+
+    tiles, status = zip(*responses)
 
+    print("#tiles: {} | written: {}\tfailed:{}".format(len(tiles), sum(status), len(tiles) - sum(status)))
+    if retries.done or dead_letter:
+        print("retried: {} written after retry, {} dead-lettered".format(len(retries.done), len(dead_letter)))
+    print(format_summary(result.timings))
 
-    __TILER = partial(_write_tile, image = f,
-                     output_dir = output_dir, bands = indexes,
-                     quant = quant, aws_profile = aws_profile,
-                     skip_blanks = skip_blanks, nodata_val = f.nodata,
-                     max_nodata_pct = max_nodata_pct)
+    return(result)
 
-    with futures.ThreadPoolExecutor() as executor:
-        responses = list(executor.map(__TILER, tiles))
 
-    tiles, status = zip(*responses) 
 
-    print("#tiles: {} | written: {}\tfailed:{}".format(len(tiles), sum(status), len(tiles) - sum(status)))
 
-    return(responses)
+def _scene_tiles(strip_size = 16, read_workers = 4, encode_workers = 1, upload_workers = 16, queue_size = 32):
+    """
+        upper bound on the tiles one scene holds in flight: strips being read, the read -> encode and encode -> upload queues and the retry queue (up to queue_size each), and tiles inside the encode and upload workers.
+    """
+    return read_workers * strip_size + 3 * queue_size + encode_workers + upload_workers
+
+def _scene_memory(n_bands, tile_size = 512, **limits):
+    """
+        rough upper bound on the memory (bytes) one scene holds in flight (see _scene_tiles for <limits>). assumes float64 pixels (worst case after --quant) for every tile, encoded or not.
+    """
+    return _scene_tiles(**limits) * n_bands * tile_size * tile_size * 8
+
+def _scene_limits(scene_workers, max_tiles = None, strip_size = 16, read_workers = 4, encode_workers = None, upload_workers = 16, queue_size = 32):
+    """
+        per-scene settings for <scene_workers> concurrent scenes: encode_workers share the cpus unless given, and with <max_tiles> strip_size and queue_size are cut so each scene's tiles in flight (see _scene_tiles) fit its share. returns them all as a dict.
+    """
+    if encode_workers is None:
+        encode_workers = max(1, (cpu_count() or 1) // scene_workers)
+
+    if max_tiles is not None:
+        room = max_tiles // scene_workers - encode_workers - upload_workers
+        # strips first, leaving at least one tile per queue
+        strip_size = max(1, min(strip_size, (room - 3) // read_workers))
+        queue_size = max(1, (room - read_workers * strip_size) // 3)
 
+    return {'strip_size' : strip_size, 'read_workers' : read_workers, 'encode_workers' : encode_workers,
+            'upload_workers' : upload_workers, 'queue_size' : queue_size}
 
+def tile_scenes(images, output_dir, scene_workers = 1, max_tiles = None, memory_budget = None, manifest_dir = None, container = None, label_file = None, label_dir = None, timings = False, **kwargs):
+    """
+    Tile many scenes at once: scenes are spread over a pool of <scene_workers> processes, and each scene runs its own read/encode/upload threads (see tile_image, which receives **kwargs). Tiles for <image> go to <output_dir>/<image basename>/, or into <output_dir>/<image basename>.mbtiles with container = 'mbtiles'.
 
+    With <label_file>, every scene is tiled paired with that ground truth raster (see tile_image). Label tiles go to <label_dir>/<label basename>/ (label_dir defaults to output_dir), or <label_dir>/<image basename>_<label basename>.mbtiles for containers.
 
-def main(args):
-    all_tiles = []
+    Each scene records its tiles in <manifest_dir>/<image basename>.manifest.sqlite (see tile_image's manifest and resume arguments). manifest_dir defaults to output_dir, or the current directory when output_dir is s3://. With <timings>, per-tile stage timings go to <manifest_dir>/<image basename>.timings.jsonl.
 
-    for image in args.files:
+    <max_tiles> caps the number of tiles in flight (see _scene_tiles) across all concurrently running scenes. <memory_budget> (MB) caps scene_workers so that the estimated in-flight memory of all running scenes fits (see _scene_memory). Returns {image: tile_image results, or None if the scene failed}.
+    """
+    scene_workers = max(1, min(scene_workers, len(images)))
+
+    settings = {name : kwargs[name] for name in ['strip_size', 'read_workers', 'encode_workers', 'upload_workers', 'queue_size']
+                if kwargs.get(name) is not None}
+    limits = _scene_limits(scene_workers, max_tiles, **settings)
+
+    if memory_budget is not None:
+        # fewer scenes each get more cpus and queue room: settle their number before the per-scene settings
+        indexes = kwargs.get('indexes')
+        n_bands = len(indexes) if indexes else 4
+        fits = scene_workers
+        while fits > 1 and fits * _scene_memory(n_bands, **limits) > memory_budget * 1024 * 1024:
+            fits -= 1
+            limits = _scene_limits(fits, max_tiles, **settings)
+        if fits < scene_workers:
+            print("memory budget ({} MB) fits {} concurrent scene(s) at ~{:.0f} MB each, reducing from {}".format(memory_budget, fits, _scene_memory(n_bands, **limits) / 1024 / 1024, scene_workers))
+            scene_workers = fits
+
+    kwargs.update(limits)
+
+    if manifest_dir is None:
+        manifest_dir = "." if output_dir.startswith("s3://") else output_dir
+    makedirs(manifest_dir, exist_ok = True)
+
+    def __output(image):
         fbase = path.splitext(path.basename(image))[0]
-        image_output = path.join(args.output_dir, fbase)
-        all_tiles.append(tile_image(image, image_output, args.zoom, args.cover, args.indexes, args.quant, args.aws_profile, args.skip_blanks, args.max_nodata_pct))
+        if container == 'mbtiles':
+            fbase += ".mbtiles"
+        return path.join(output_dir, fbase)
+
+    def __labels(image):
+        if label_file is None:
+            return None
+        lbase = path.splitext(path.basename(label_file))[0]
+        if container == 'mbtiles':
+            lbase = "{}_{}.mbtiles".format(path.splitext(path.basename(image))[0], lbase)
+        return path.join(label_dir or output_dir, lbase)
+
+    def __manifest(image):
+        fbase = path.splitext(path.basename(image))[0]
+        return path.join(manifest_dir, "{}.manifest.sqlite".format(fbase))
+
+    def __timings(image):
+        if not timings:
+            return None
+        fbase = path.splitext(path.basename(image))[0]
+        return path.join(manifest_dir, "{}.timings.jsonl".format(fbase))
+
+    results = {}
+    if scene_workers == 1:
+        for image in images:
+            # as in the pool below, one bad scene does not stop the others
+            try:
+                results[image] = tile_image(image, __output(image), manifest = __manifest(image), timings_file = __timings(image),
+                                            label_file = label_file, label_output_dir = __labels(image), **kwargs)
+            except Exception as e:
+                print("failed to tile {}: {}".format(image, e))
+                results[image] = None
+        return results
+
+    with futures.ProcessPoolExecutor(max_workers = scene_workers) as executor:
+        jobs = {executor.submit(tile_image, image, __output(image), manifest = __manifest(image), timings_file = __timings(image),
+                                label_file = label_file, label_output_dir = __labels(image), **kwargs): image
+                for image in images}
+
+        for job in futures.as_completed(jobs):
+            image = jobs[job]
+            try:
+                results[image] = job.result()
+            except Exception as e:
+                print("failed to tile {}: {}".format(image, e))
+                results[image] = None
+
+    return results
+
+def main(args):
+    return tile_scenes(args.files, args.output_dir,
+                       scene_workers = args.scene_workers,
+                       max_tiles = args.max_tiles,
+                       memory_budget = args.memory_budget,
+                       manifest_dir = args.manifest_dir,
+                       container = args.container,
+                       label_file = args.mask,
+                       label_dir = args.mask_output_dir,
+                       timings = args.timings,
+                       resume = args.resume,
+                       zoom = args.zoom,
+                       zooms = args.zooms,
+                       footprint = args.footprint,
+                       min_overlap = args.min_overlap,
+                       cover = args.cover,
+                       indexes = args.indexes,
+                       quant = args.quant,
+                       aws_profile = args.aws_profile,
+                       skip_blanks = args.skip_blanks,
+                       max_nodata_pct = args.max_nodata_pct,
+                       strip_size = args.strip_size,
+                       s3_pool_size = args.s3_pool_size,
+                       s3_endpoint_url = args.s3_endpoint_url,
+                       read_workers = args.read_workers,
+                       encode_workers = args.encode_workers,
+                       upload_workers = args.upload_workers,
+                       queue_size = args.queue_size,
+                       blank_decimation = args.blank_decimation,
+                       blank_margin = args.blank_margin,
+                       dtype = args.dtype,
+                       compress = args.compress,
+                       predictor = args.predictor,
+                       blocksize = args.blocksize,
+                       retry_workers = args.retry_workers,
+                       gdal_cachemax = args.gdal_cachemax,
+                       vsi_cache_size = args.vsi_cache_size)
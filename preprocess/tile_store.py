@@ -0,0 +1,125 @@
+"""
+tile_store
+
+single-file tile containers: all of a scene's GeoTIFF tiles stored in one MBTiles (SQLite) file keyed by z/x/y, instead of one object per tile.
+"""
+
+import sqlite3
+import threading
+import unittest
+
+from os import path, getpid
+from tempfile import TemporaryDirectory
+
+from mercantile import Tile
+
+class TestTileStore(unittest.TestCase):
+    def test_write_read(self):
+        with TemporaryDirectory() as tmp:
+            filename = path.join(tmp, "scene.mbtiles")
+
+            writer = MBTilesWriter(filename, batch_size = 2)
+            writer.put(Tile(1, 2, 15), b"a")
+            writer.put(Tile(3, 4, 15), b"b")
+            writer.put(Tile(5, 6, 15), b"c")
+            writer.close()
+
+            reader = MBTilesReader(filename)
+            self.assertEqual(len(reader), 3)
+            self.assertEqual(reader[Tile(3, 4, 15)], b"b")
+            self.assertEqual(set(reader), set([Tile(1, 2, 15), Tile(3, 4, 15), Tile(5, 6, 15)]))
+            with self.assertRaises(KeyError):
+                reader[Tile(0, 0, 15)]
+            reader.close()
+
+def _tms_row(tile):
+    "MBTiles rows are TMS (y flipped)"
+    return (2 ** tile.z) - 1 - tile.y
+
+class MBTilesWriter(object):
+    """
+    Batched, thread-safe writer of encoded tiles into an MBTiles file. Tiles are buffered and inserted <batch_size> at a time in a single transaction; existing tiles with the same z/x/y are replaced. close() flushes the last batch.
+    """
+    def __init__(self, filename, batch_size = 256, metadata = None):
+        self.filename = filename
+        self.batch_size = batch_size
+
+        self._lock = threading.Lock()
+        self._batch = []
+
+        self.conn = sqlite3.connect(filename, check_same_thread = False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tiles (
+                zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER,
+                tile_data BLOB,
+                PRIMARY KEY (zoom_level, tile_column, tile_row)
+            )""")
+
+        metadata = dict({'format' : 'tiff'}, **(metadata or {}))
+        self.conn.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)", list(metadata.items()))
+        self.conn.commit()
+
+    def put(self, tile, data):
+        "add encoded tile bytes for <tile>"
+        with self._lock:
+            self._batch.append((int(tile.z), int(tile.x), _tms_row(tile), sqlite3.Binary(data)))
+            if len(self._batch) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        self.conn.executemany("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)", self._batch)
+        self.conn.commit()
+        self._batch = []
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self.conn.execute("PRAGMA journal_mode = DELETE") # fold WAL back in so the file stands alone
+            self.conn.close()
+
+class MBTilesReader(object):
+    """
+    Read-only access to an MBTiles file written by MBTilesWriter: iterate the tiles it holds, index by Tile for the encoded bytes, or read(tile) for a numpy array. The connection is opened per process, so a reader can be shared with data-loader worker processes.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != getpid():
+            self._conn = sqlite3.connect("file:{}?mode=ro".format(self.filename), uri = True)
+            self._pid = getpid()
+        return self._conn
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+
+    def __iter__(self):
+        for z, x, row in self.conn.execute("SELECT zoom_level, tile_column, tile_row FROM tiles"):
+            yield Tile(x, (2 ** z) - 1 - row, z)
+
+    def __getitem__(self, tile):
+        found = self.conn.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (int(tile.z), int(tile.x), _tms_row(tile))).fetchone()
+        if found is None:
+            raise KeyError(tile)
+        return bytes(found[0])
+
+    def read(self, tile):
+        "decode a tile to a (bands, height, width) array"
+        import rasterio as rio
+
+        with rio.MemoryFile(self[tile]) as mf:
+            with mf.open() as src:
+                return src.read()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
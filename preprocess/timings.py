@@ -0,0 +1,87 @@
+"""
+timings
+
+per-tile stage timings (read, nodata check, encode, upload) and bytes written, aggregated per scene into percentiles and optionally logged as JSON lines.
+"""
+
+import json
+import unittest
+
+from os import path
+from tempfile import TemporaryDirectory
+
+import numpy as np
+from mercantile import Tile
+
+class TestStageTimings(unittest.TestCase):
+    def test_summary(self):
+        with TemporaryDirectory() as tmp:
+            jsonl = path.join(tmp, "scene.timings.jsonl")
+            timings = StageTimings(jsonl)
+            for i in range(100):
+                timings.add(Tile(i, 0, 15), 'written', {'read' : i / 1000, 'upload' : 0.01}, 1000 + i)
+            timings.add(Tile(100, 0, 15), 'skipped', {'read' : 0.5, 'check' : 0.001})
+            timings.close()
+
+            summary = timings.summary()
+            self.assertEqual(summary['read']['n'], 101)
+            self.assertAlmostEqual(summary['upload']['p99'], 0.01)
+            self.assertEqual(summary['bytes']['total'], sum(1000 + i for i in range(100)))
+            self.assertNotIn('encode', summary)
+
+            with open(jsonl) as fp:
+                lines = [json.loads(line) for line in fp]
+            self.assertEqual(len(lines), 101)
+            self.assertEqual(lines[-1]['tile'], [100, 0, 15])
+
+STAGES = ('read', 'check', 'encode', 'upload')
+
+PERCENTILES = (50, 95, 99)
+
+class StageTimings(object):
+    """
+    Collects one scene's per-tile timings: add() takes a tile's {stage: seconds} and the bytes written for it. summary() gives, for each stage seen and for bytes, {'n', 'total', 'p50', 'p95', 'p99'}.
+
+    If <jsonl> is given, every tile is also appended to that file as a JSON line ({"tile": [x, y, z], "status", "bytes", <stage>: seconds}). Not thread-safe; add from the thread consuming pipeline results.
+    """
+    def __init__(self, jsonl = None):
+        self.samples = {stage : [] for stage in STAGES + ('bytes',)}
+        self._fp = open(jsonl, 'a') if jsonl is not None else None
+
+    def add(self, tile, status, timings, nbytes = None):
+        for stage, seconds in timings.items():
+            self.samples.setdefault(stage, []).append(seconds)
+        if nbytes:
+            self.samples['bytes'].append(nbytes)
+
+        if self._fp is not None:
+            line = dict(timings, tile = [int(tile.x), int(tile.y), int(tile.z)], status = status, bytes = nbytes)
+            self._fp.write(json.dumps(line) + "\n")
+
+    def summary(self):
+        summary = {}
+        for stage, values in self.samples.items():
+            if not values:
+                continue
+            summary[stage] = dict(zip(['p{}'.format(p) for p in PERCENTILES],
+                                      np.percentile(values, PERCENTILES).tolist()),
+                                  n = len(values), total = float(np.sum(values)))
+        return summary
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+def format_summary(summary):
+    "printable table of a StageTimings summary: stage times in ms, bytes in kB"
+    lines = ["{:<8} {:>8} {:>10} {:>10} {:>10} {:>10}".format("stage", "n", "total", "p50", "p95", "p99")]
+    for stage in STAGES + ('bytes',):
+        if stage not in summary:
+            continue
+        s = summary[stage]
+        scale, unit = (1 / 1024, "kB") if stage == 'bytes' else (1000, "ms")
+        lines.append("{:<8} {:>8} {:>10.0f} {:>10.1f} {:>10.1f} {:>10.1f}  {}".format(
+            stage, s['n'], s['total'] * scale, s['p50'] * scale, s['p95'] * scale, s['p99'] * scale, unit))
+
+    return "\n".join(lines)
@@ -1,6 +1,7 @@
 import numpy as np
 import rasterio
 from rasterio.warp import calculate_default_transform, reproject, Resampling
+from affine import Affine
 
 def reproject_raster(raster_file, dst_crs, dst_file):
     dst_crs = {"init" : "EPSG:{}".format(dst_crs)}
@@ -26,3 +27,23 @@ def reproject_raster(raster_file, dst_crs, dst_file):
                     dst_transform=transform,
                     dst_crs=dst_crs,
                     resampling=Resampling.nearest)
+
+def valid_footprint(src, decimation = 16):
+    """
+    Polygon (in the crs of open dataset src) around src's valid, non-nodata, pixels.
+
+    Traced from the dataset mask read at 1/decimation resolution (GDAL serves this from overviews when present), then buffered by one decimated pixel so valid pixels at the edges are not cut off.
+    """
+    from rasterio.features import shapes
+    from shapely.geometry import shape
+    from shapely.ops import unary_union
+
+    height = max(1, src.height // decimation)
+    width = max(1, src.width // decimation)
+
+    mask = src.dataset_mask(out_shape = (height, width))
+    transform = src.transform * Affine.scale(src.width / width, src.height / height)
+
+    polygons = [shape(geom) for geom, value in shapes(mask, mask = mask > 0, transform = transform)]
+
+    return unary_union(polygons).buffer(max(abs(transform.a), abs(transform.e)))